@@ -1,46 +1,268 @@
+import argparse
+import asyncio
+import concurrent.futures
+import heapq
+import io
+import itertools
+import json
+import multiprocessing
+import numpy as np
+import os
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
 import random
+import re
+import threading
 import time
-from datetime import date
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime
 from faker import Faker
 
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
 DATABASE_NAME = 'finalproject'
+BULK_CHUNK_SIZE = 10000
+STREAM_ITERSIZE = 2000
+ASYNC_CONCURRENCY = 8
+ASYNC_BATCH_SIZE = 500
+ASYNC_RETRIES = 5
+DATA_POOL_SIZE = 1000
+SNOWFLAKE_EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+SNOWFLAKE_WORKER_BITS = 10
+SNOWFLAKE_SEQUENCE_BITS = 12
+TIME_PARTITION_MONTHS_BACK = 12
+TIME_PARTITION_MONTHS_AHEAD = 3
+BENCHMARK_SCALES = (1000, 10000, 100000, 1000000, 10000000)
+REGIONS = ["LATAM", "EMEA", "APJ"]
+REGION_TABLES = {region: f"Customer_Region_{region}" for region in REGIONS}
+PAYMENT_MODES = ["Credit Card", "PayPal", "Cash"]
+PRODUCT_CATALOG = {
+    "Electronics": ("Smartphone", "Laptop", "Camera"),
+    "Clothing and Fashion": ("Shirt", "Dress", "Shoes"),
+    "Home and Furniture": ("Sofa", "Table", "Bedding"),
+}
+
+FAST_LOAD_PARALLELISM = 4
+FAST_LOAD_MAINTENANCE_WORK_MEM_MB = int(os.environ.get('FAST_LOAD_MAINTENANCE_WORK_MEM_MB', 1024))
+PG_POOL_MIN = int(os.environ.get('PG_POOL_MIN', 1))
+PG_POOL_MAX = int(os.environ.get('PG_POOL_MAX', 10))
+PG_POOL_TIMEOUT = float(os.environ.get('PG_POOL_TIMEOUT', 30))
+PG_POOL_HEALTH_CHECK_AFTER = float(os.environ.get('PG_POOL_HEALTH_CHECK_AFTER', 30))
+
+INSTRUMENT_SLOW_MS = float(os.environ.get('INSTRUMENT_SLOW_MS', 100))
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_FAKER = Faker()
+_DATA_POOLS = {}
+_STREAM_CURSOR_IDS = itertools.count()
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_PID = None
+_CONNECTION_POOLS_LOCK = threading.Lock()
 def create_database(dbname):
     """Connect to the PostgreSQL by calling connect_postgres() function
        Create a database named {DATABASE_NAME}
        Close the connection"""
     try:
+        # Pooled connections to the old database would block DROP DATABASE
+        close_pool(dbname)
+
         # Connect to the default PostgreSQL database
-        conn = connect_potsgres()
-        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-        cursor = conn.cursor()
+        with pooled_connection() as conn:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
 
-        # Check if the database exists and drop it if it does
-        cursor.execute(f"DROP DATABASE IF EXISTS {dbname};")
+            # Check if the database exists and drop it if it does
+            cursor.execute(f"DROP DATABASE IF EXISTS {dbname};")
 
-        # Create a database with the specified name
-        cursor.execute(f"CREATE DATABASE {dbname};")
+            # Create a database with the specified name
+            cursor.execute(f"CREATE DATABASE {dbname};")
 
-        print(f"Database '{dbname}' created successfully!")
+            print(f"Database '{dbname}' created successfully!")
 
-        cursor.close()
-        conn.close()
+            cursor.close()
     except Exception as error:
         print(f"Error: {error}")
 
-def connect_potsgres(dbname="postgres"):
-    """Connect to the PostgreSQL using psycopg2 with default database
-       Return the connection"""
+
+def postgres_dsn(dbname="postgres"):
+    """Connection string for dbname. POSTGRES_DSN, or PGUSER/PGPASSWORD/PGHOST/PGPORT,
+       override the local defaults"""
+    dsn = os.environ.get('POSTGRES_DSN')
+    if dsn:
+        return psycopg2.extensions.make_dsn(dsn, dbname=dbname)
+    return psycopg2.extensions.make_dsn(user=os.environ.get('PGUSER', 'postgres'),
+                                        password=os.environ.get('PGPASSWORD', 'Super@123'),
+                                        host=os.environ.get('PGHOST', 'localhost'),
+                                        port=os.environ.get('PGPORT', '5432'),
+                                        dbname=dbname)
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """No connection became free within the acquire timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool of connections to one database.
+       Idle connections that sat longer than health_check_after seconds are
+       pinged before being handed out; broken ones are replaced."""
+
+    def __init__(self, dsn, minconn=PG_POOL_MIN, maxconn=PG_POOL_MAX, acquire_timeout=PG_POOL_TIMEOUT,
+                 health_check_after=PG_POOL_HEALTH_CHECK_AFTER):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._available = threading.Condition()
+        self.stats = {'created': 0, 'closed': 0, 'acquired': 0, 'in_use': 0, 'failed_health_checks': 0,
+                      'timeouts': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self.stats['created'] += 1
+        return conn
+
+    def _discard(self, conn):
+        if not conn.closed:
+            conn.close()
+        self.stats['closed'] += 1
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            self.stats['failed_health_checks'] += 1
+            return False
+
+    def acquire(self):
+        """Check out a connection, waiting up to acquire_timeout for one to free up"""
+        start = time.monotonic()
+        with self._available:
+            if self._closed:
+                raise psycopg2.pool.PoolError("Connection pool is closed")
+            while not self._idle and self._size >= self.maxconn:
+                remaining = self.acquire_timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self.stats['timeouts'] += 1
+                    raise PoolTimeout(f"No connection available within {self.acquire_timeout}s")
+                self._available.wait(remaining)
+            idle = self._idle.popleft() if self._idle else None
+            if idle is None:
+                self._size += 1
+            waited = time.monotonic() - start
+            self.stats['acquired'] += 1
+            self.stats['in_use'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+
+        try:
+            if idle is not None:
+                conn, idle_since = idle
+                if not self._healthy(conn, idle_since):
+                    self._discard(conn)
+                    conn = self._connect()
+            else:
+                conn = self._connect()
+            conn.cursor_factory = InstrumentedCursor if INSTRUMENTATION is not None else psycopg2.extensions.cursor
+            return conn
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self.stats['in_use'] -= 1
+                self._available.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection; open transactions are rolled back and autocommit reset"""
+        try:
+            if not conn.closed:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = False
+        except psycopg2.Error:
+            self._discard(conn)
+        with self._available:
+            self.stats['in_use'] -= 1
+            if self._closed and not conn.closed:
+                self._discard(conn)
+            if conn.closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    def close(self):
+        """Close every idle connection; checked-out ones close when released"""
+        with self._available:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._discard(conn)
+                self._size -= 1
+            self._closed = True
+
+    def metrics(self):
+        with self._available:
+            metrics = dict(self.stats, size=self._size, idle=len(self._idle))
+        metrics['avg_wait_seconds'] = metrics['wait_seconds'] / metrics['acquired'] if metrics['acquired'] else 0.0
+        return metrics
+
+
+def get_pool(dbname="postgres"):
+    """Return this process's pool for dbname, creating it on first use"""
+    global _CONNECTION_POOLS_PID
+    with _CONNECTION_POOLS_LOCK:
+        # A forked child must not reuse its parent's sockets
+        if _CONNECTION_POOLS_PID != os.getpid():
+            _CONNECTION_POOLS.clear()
+            _CONNECTION_POOLS_PID = os.getpid()
+        if dbname not in _CONNECTION_POOLS:
+            _CONNECTION_POOLS[dbname] = ConnectionPool(postgres_dsn(dbname))
+        return _CONNECTION_POOLS[dbname]
+
+
+def close_pool(dbname):
+    """Close and forget the pool for dbname, if there is one"""
+    with _CONNECTION_POOLS_LOCK:
+        pool = _CONNECTION_POOLS.pop(dbname, None) if _CONNECTION_POOLS_PID == os.getpid() else None
+    if pool is not None:
+        pool.close()
+
+
+@contextmanager
+def pooled_connection(dbname="postgres"):
+    """Borrow a connection from the pool for the duration of a with block"""
+    pool = get_pool(dbname)
+    conn = pool.acquire()
     try:
-        # Connection parameters
-        user = 'postgres'
-        dbname = dbname
-        host = 'localhost'
-        password = 'hello'
-        port = 5430
+        yield conn
+    finally:
+        pool.release(conn)
 
-        # Establish a connection to the PostgreSQL connection
-        connection = psycopg2.connect(user = user, dbname=dbname, host=host, password="Super@123", port=5432)
+
+def connect_potsgres(dbname="postgres"):
+    """Check out a pooled connection to dbname
+       Return the connection; hand it back with release_potsgres()"""
+    try:
+        connection = get_pool(dbname).acquire()
 
         print ("Connected to the PostgreSQL database successfully!")
 
@@ -50,6 +272,189 @@ def connect_potsgres(dbname="postgres"):
         return None
 
 
+def release_potsgres(conn, dbname="postgres"):
+    """Return a connection obtained from connect_potsgres() to its pool"""
+    get_pool(dbname).release(conn)
+
+
+def print_pool_metrics():
+    """Print in-use count, wait time and churn for every pool in this process"""
+    for dbname, pool in list(_CONNECTION_POOLS.items()):
+        metrics = pool.metrics()
+        print(f"\nConnection pool '{dbname}': {metrics['in_use']} in use, {metrics['idle']} idle, "
+              f"{metrics['acquired']} checkouts, avg wait {metrics['avg_wait_seconds'] * 1000:.2f} ms, "
+              f"max wait {metrics['max_wait_seconds'] * 1000:.2f} ms, "
+              f"{metrics['created']} created / {metrics['closed']} closed")
+
+
+
+class Instrumentation:
+    """Per-statement latency histograms, row counts and parameter shapes collected by
+       InstrumentedCursor. Statements are grouped by their text with literals folded
+       away. A SELECT slower than slow_ms gets an EXPLAIN (ANALYZE, BUFFERS) plan,
+       up to explain_samples per statement. EXPLAIN ANALYZE runs the query again, so
+       SELECTs that take locks or advance sequences are never explained."""
+
+    def __init__(self, slow_ms=INSTRUMENT_SLOW_MS, explain_samples=1):
+        self.slow_ms = slow_ms
+        self.explain_samples = explain_samples
+        self.stage = None
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def record(self, statement, params, seconds, rows):
+        ms = seconds * 1000
+        key = (self.stage, statement)
+        with self._lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = {
+                    'stage': self.stage, 'statement': statement, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'rows': 0, 'histogram': [0] * (len(LATENCY_BUCKETS_MS) + 1), 'param_shapes': set(), 'plans': []}
+            entry['calls'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['rows'] += max(rows, 0)
+            entry['histogram'][sum(ms > bound for bound in LATENCY_BUCKETS_MS)] += 1
+            entry['param_shapes'].add(_params_fingerprint(params))
+            return entry
+
+    def wants_plan(self, entry, query, ms):
+        with self._lock:
+            return (ms >= self.slow_ms and len(entry['plans']) < self.explain_samples
+                    and re.match(r'\s*select\b', query, re.IGNORECASE) is not None
+                    and re.search(r'\b(?:nextval|setval|pg_advisory\w*)\s*\(|\bfor (?:update|share)\b',
+                                  query, re.IGNORECASE) is None)
+
+    def report(self):
+        """Statements sorted by total time, slowest first, with JSON-friendly fields"""
+        with self._lock:
+            entries = [dict(entry, param_shapes=sorted(entry['param_shapes']), plans=list(entry['plans']))
+                       for entry in self.statements.values()]
+        for entry in entries:
+            entry['mean_ms'] = entry['total_ms'] / entry['calls']
+            entry['p95_ms'] = _histogram_percentile(entry['histogram'], 0.95)
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+
+INSTRUMENTATION = None
+
+
+def _statement_fingerprint(query):
+    """Statement text with literals replaced by ? and VALUES lists folded, so that
+       executions differing only in their values group together"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = re.sub(r"'(?:[^']|'')*'", '?', query)
+    query = re.sub(r'\b\d+(?:\.\d+)?\b', '?', query)
+    query = re.sub(r'\s+', ' ', query).strip()
+    query = re.sub(r'\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)', '(...)', query)
+    return re.sub(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+', '(...), ...', query)
+
+
+def _params_fingerprint(params):
+    """Types of the parameters, e.g. 'int,str,date', so the report shows how a
+       statement is called without storing customer data"""
+    if params is None:
+        return ''
+    if isinstance(params, dict):
+        params = list(params.values())
+    return ','.join(type(param).__name__ for param in params)
+
+
+def _histogram_percentile(histogram, fraction):
+    """Upper bound of the bucket holding the given fraction of calls"""
+    target = fraction * sum(histogram)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS + (float('inf'),), histogram):
+        seen += count
+        if seen >= target:
+            return bound
+    return float('inf')
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every execute, executemany and copy_expert to INSTRUMENTATION.
+       Pooled connections hand it out while instrumentation is enabled."""
+
+    def _timed(self, method, query, params, *args):
+        start = time.perf_counter()
+        try:
+            return method(query, params, *args) if params is not None or args else method(query)
+        finally:
+            seconds = time.perf_counter() - start
+            instrumentation = INSTRUMENTATION
+            if instrumentation is not None:
+                statement = _statement_fingerprint(query)
+                entry = instrumentation.record(statement, params, seconds, self.rowcount)
+                if instrumentation.wants_plan(entry, statement, seconds * 1000):
+                    self._explain(entry, query, params)
+
+    def _explain(self, entry, query, params):
+        conn = self.connection
+        if conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            return
+        # A plain cursor, so the EXPLAIN itself is not instrumented
+        cursor = psycopg2.extensions.cursor(conn)
+        try:
+            # A failed EXPLAIN must not abort the caller's transaction
+            if not conn.autocommit:
+                cursor.execute("SAVEPOINT instrument_explain;")
+            try:
+                cursor.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + self.mogrify(query, params))
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            except psycopg2.Error:
+                if not conn.autocommit:
+                    cursor.execute("ROLLBACK TO SAVEPOINT instrument_explain;")
+                return
+            if not conn.autocommit:
+                cursor.execute("RELEASE SAVEPOINT instrument_explain;")
+            with INSTRUMENTATION._lock:
+                entry['plans'].append(plan)
+        finally:
+            cursor.close()
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(lambda query, _: super(InstrumentedCursor, self).copy_expert(query, file, size), sql, ())
+
+
+def enable_instrumentation(slow_ms=INSTRUMENT_SLOW_MS, explain_samples=1):
+    """Instrument every connection checked out of a pool from now on in this process
+       Return the Instrumentation collecting the numbers"""
+    global INSTRUMENTATION
+    INSTRUMENTATION = Instrumentation(slow_ms, explain_samples)
+    return INSTRUMENTATION
+
+
+def print_instrumentation_report(top=20, output=None):
+    """Print the top statements by total time and the sampled slow plans
+       Write the full report as JSON to output, if given"""
+    if INSTRUMENTATION is None:
+        return []
+    report = INSTRUMENTATION.report()
+    print(f"\nStatements by total time (top {top} of {len(report)})")
+    print("----------------------------------------------------")
+    for entry in report[:top]:
+        print(f"[{entry['stage'] or 'setup'}] {entry['calls']} calls, {entry['total_ms']:.1f} ms total, "
+              f"{entry['mean_ms']:.2f} ms mean, p95 <= {entry['p95_ms']} ms, max {entry['max_ms']:.1f} ms, "
+              f"{entry['rows']} rows")
+        print(f"    {entry['statement'][:120]}")
+    for entry in report:
+        for plan in entry['plans']:
+            print(f"\nSlow statement ({entry['max_ms']:.1f} ms) in {entry['stage']}: {entry['statement'][:120]}")
+            print(plan)
+    if output:
+        with open(output, 'w') as file:
+            json.dump({'buckets_ms': LATENCY_BUCKETS_MS, 'statements': report}, file, indent=2)
+        print(f"\nInstrumentation report written to {output}")
+    return report
+
 
 def create_tables(conn):
     try:
@@ -152,19 +557,340 @@ def create_tables(conn):
         print(f"Error creating tables: {error}")
 
 
-def vertical_partitioning(conn):
+def _add_months(day, months):
+    """First day of the month that is months away from day's month"""
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def _create_month_partitions(cursor, first_month, last_month):
+    """Create the missing monthly partitions of Orders and Shipments between two months"""
+    created = []
+    month = first_month
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        for table in ('Orders', 'Shipments'):
+            partition = f"{table.lower()}_y{month.year}m{month.month:02d}"
+            cursor.execute("SELECT to_regclass(%s) IS NULL;", (partition,))
+            if cursor.fetchone()[0]:
+                cursor.execute(f"CREATE TABLE {partition} PARTITION OF {table} "
+                               f"FOR VALUES FROM ('{month}') TO ('{next_month}');")
+                created.append(partition)
+        month = next_month
+    return created
+
+
+def time_partitioning(conn, months_back=TIME_PARTITION_MONTHS_BACK, months_ahead=TIME_PARTITION_MONTHS_AHEAD):
+    """Recreate Orders and Shipments as tables partitioned by month on order_date and
+       shipment_date, with partitions from months_back months ago to months_ahead
+       months from now and a BRIN index on Shipments.shipment_date.
+       Unique keys on a partitioned table must include the partition key, so Orders is
+       keyed on (order_id, order_date) and Shipments on (shipping_id, shipment_date),
+       and the foreign keys from Shipments and OrderItems into Orders are dropped.
+       Run right after create_tables(), before anything hangs off these tables."""
+    cursor = conn.cursor()
+
+    cursor.execute("ALTER TABLE OrderItems DROP CONSTRAINT IF EXISTS orderitems_order_sequence_id_fkey;")
+    cursor.execute("DROP TABLE IF EXISTS Shipments, Orders CASCADE;")
+
+    cursor.execute("""
+        CREATE TABLE Orders (
+            order_id INT,
+            customer_id INT,
+            order_date DATE NOT NULL,
+            payment_id INT,
+            quantity INT,
+            price INT,
+            order_sequence_id bigint,
+            PRIMARY KEY (order_id, order_date),
+            UNIQUE (order_sequence_id, order_date),
+            FOREIGN KEY (customer_id) REFERENCES Customer (customer_id),
+            FOREIGN KEY (payment_id) REFERENCES Payments (payment_id)
+        ) PARTITION BY RANGE (order_date);
+    """)
+    cursor.execute("""
+        CREATE TABLE Shipments (
+            shipping_id SERIAL,
+            order_id INT,
+            shipment_date DATE NOT NULL,
+            customer_shipping_address VARCHAR(255),
+            customer_region VARCHAR(255),
+            PRIMARY KEY (shipping_id, shipment_date)
+        ) PARTITION BY RANGE (shipment_date);
+    """)
+    # Shipments arrive in date order, so block ranges stay tight and the BRIN index tiny
+    cursor.execute("CREATE INDEX shipments_shipment_date_brin ON Shipments USING brin (shipment_date);")
+
+    this_month = _add_months(date.today(), 0)
+    _create_month_partitions(cursor, _add_months(this_month, -months_back), _add_months(this_month, months_ahead))
+
+    print (" Time partitioning done successfully!")
+    conn.commit()
+    cursor.close()
+
+
+def _purge_derived_rows(cursor, table, partition):
+    """Remove a partition's rows from the tables the Orders and Shipments triggers
+       feed. Detaching or dropping a partition fires no DELETE triggers, so without
+       this the vertical fragments and Customer_Order_Counts would keep them."""
+    if table == 'shipments':
+        for fragment in ('shipment_details_table', 'customer_details_table'):
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (fragment,))
+            if cursor.fetchone()[0]:
+                cursor.execute(f"DELETE FROM {fragment} d USING {partition} p WHERE d.shipping_id = p.shipping_id;")
+    elif table == 'orders':
+        cursor.execute("SELECT to_regclass('customer_order_counts') IS NOT NULL;")
+        if cursor.fetchone()[0]:
+            cursor.execute(f"""
+                UPDATE Customer_Order_Counts c SET order_count = c.order_count - p.orders
+                FROM (SELECT customer_id, count(order_id) AS orders FROM {partition} GROUP BY customer_id) p
+                WHERE c.customer_id = p.customer_id;
+            """)
+            cursor.execute("DELETE FROM Customer_Order_Counts WHERE order_count <= 0;")
+
+
+def maintain_time_partitions(conn, months_ahead=TIME_PARTITION_MONTHS_AHEAD, retention_months=TIME_PARTITION_MONTHS_BACK,
+                             drop=False):
+    """Create Orders and Shipments partitions up to months_ahead months from now and
+       detach those that ended more than retention_months months ago, dropping them
+       too if drop is set. Their rows are taken out of the vertical fragments and the
+       order count rollup in the same transaction. Meant to run on a schedule, e.g. daily.
+       Return the created and the expired partition names."""
+    cursor = conn.cursor()
+    this_month = _add_months(date.today(), 0)
+    created = _create_month_partitions(cursor, this_month, _add_months(this_month, months_ahead))
+
+    cutoff = _add_months(this_month, -retention_months)
+    expired = []
+    cursor.execute("""
+        SELECT parent.relname, child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = inhparent
+        JOIN pg_class child ON child.oid = inhrelid
+        WHERE parent.relname IN ('orders', 'shipments');
+    """)
+    for table, partition in cursor.fetchall():
+        match = re.fullmatch(r'\w+_y(\d{4})m(\d{2})', partition)
+        if match and _add_months(date(int(match.group(1)), int(match.group(2)), 1), 1) <= cutoff:
+            _purge_derived_rows(cursor, table, partition)
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {partition};")
+            if drop:
+                cursor.execute(f"DROP TABLE {partition};")
+            expired.append(partition)
+
+    conn.commit()
+    cursor.close()
+    print(f" Partition maintenance: {len(created)} created, {len(expired)} {'dropped' if drop else 'detached'}")
+    return created, expired
+
+
+def benchmark_time_partitioning(num_rows=1000000, months=24, scans=5, dbname='finalproject_bench'):
+    """Spread num_rows orders and shipments over months months of history, then time
+       a 30-day window and a full-history scan on the partitioned tables and on
+       unpartitioned copies of the same rows"""
+    create_database(dbname)
+    with pooled_connection(dbname) as conn:
+        conn.autocommit = True
+        create_tables(conn)
+        time_partitioning(conn, months_back=months)
+        cursor = conn.cursor()
+        # Synthetic orders have no customers or payments behind them
+        cursor.execute("ALTER TABLE Orders DROP CONSTRAINT IF EXISTS orders_customer_id_fkey;")
+        cursor.execute("ALTER TABLE Orders DROP CONSTRAINT IF EXISTS orders_payment_id_fkey;")
+        cursor.execute("""
+            INSERT INTO Orders (order_id, customer_id, order_date, payment_id, quantity, price, order_sequence_id)
+            SELECT i, i, current_date - (i %% (%s * 30)), i, 1, 100, i FROM generate_series(1, %s) AS i;
+        """, (months, num_rows))
+        cursor.execute("""
+            INSERT INTO Shipments (order_id, shipment_date, customer_shipping_address, customer_region)
+            SELECT order_id, order_date, md5(order_id::text), 'EMEA' FROM Orders ORDER BY order_date;
+        """)
+        cursor.execute("CREATE TABLE Orders_heap AS SELECT * FROM Orders;")
+        cursor.execute("CREATE TABLE Shipments_heap AS SELECT * FROM Shipments ORDER BY shipment_date;")
+        cursor.execute("CREATE INDEX ON Shipments_heap USING brin (shipment_date);")
+        cursor.execute("VACUUM ANALYZE;")
+
+        results = {}
+        for table, column in (('Orders', 'order_date'), ('Orders_heap', 'order_date'),
+                              ('Shipments', 'shipment_date'), ('Shipments_heap', 'shipment_date')):
+            for window, predicate in (('30_days', f"{column} BETWEEN current_date - 30 AND current_date"),
+                                      ('full_history', "TRUE")):
+                query = f"SELECT count(*) FROM {table} WHERE {predicate}"
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+                scanned = json.dumps(cursor.fetchone()[0]).count('"Relation Name"')
+                start = time.perf_counter()
+                for _ in range(scans):
+                    cursor.execute(query)
+                    cursor.fetchone()
+                results[f"{table}.{window}"] = {'ms': (time.perf_counter() - start) / scans * 1000,
+                                                'relations_scanned': scanned}
+        cursor.close()
+    close_pool(dbname)
+
+    print(f"\nTime partitioning, {num_rows} orders over {months} months")
+    print("----------------------------------------------------")
+    for name, result in results.items():
+        print(f"{name:<28} {result['ms']:>9.1f} ms  {result['relations_scanned']} relation(s) scanned")
+    return results
 
+
+def vertical_partitioning(conn):
+    """Split Shipments into SHIPMENT_DETAILS_TABLE (order and date) and
+       CUSTOMER_DETAILS_TABLE (region and address), backfill them, and keep them in
+       step with Shipments through statement-level triggers: each INSERT, UPDATE or
+       DELETE on Shipments is propagated as one set-based write per fragment.
+       Readers of shipping dates can then scan the narrow fragment only."""
     cursor = conn.cursor()
 
     # cursor.execute(f"CREATE TABLE IF NOT EXISTS {SHIPMENTS_TABLE} (shipment_id serial, order_id int, shipment_date date, customer_region text, customer_shipping_address text);")
 
-    cursor.execute(f"CREATE TABLE SHIPMENT_DETAILS_TABLE AS SELECT shipping_id, order_id, shipment_date FROM Shipments;")
-    cursor.execute(f"CREATE TABLE CUSTOMER_DETAILS_TABLE AS SELECT shipping_id, customer_region, customer_shipping_address FROM Shipments;")
+    cursor.execute("DROP TABLE IF EXISTS SHIPMENT_DETAILS_TABLE, CUSTOMER_DETAILS_TABLE;")
+    cursor.execute("""
+        CREATE TABLE SHIPMENT_DETAILS_TABLE (
+            shipping_id INT PRIMARY KEY,
+            order_id INT,
+            shipment_date DATE
+        );
+    """)
+    cursor.execute("""
+        CREATE TABLE CUSTOMER_DETAILS_TABLE (
+            shipping_id INT PRIMARY KEY,
+            customer_region VARCHAR(255),
+            customer_shipping_address VARCHAR(255)
+        );
+    """)
+    cursor.execute("INSERT INTO SHIPMENT_DETAILS_TABLE SELECT shipping_id, order_id, shipment_date FROM Shipments;")
+    cursor.execute("INSERT INTO CUSTOMER_DETAILS_TABLE SELECT shipping_id, customer_region, customer_shipping_address FROM Shipments;")
+
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION shipments_fragments_insert()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO SHIPMENT_DETAILS_TABLE
+                SELECT shipping_id, order_id, shipment_date FROM new_shipments;
+            INSERT INTO CUSTOMER_DETAILS_TABLE
+                SELECT shipping_id, customer_region, customer_shipping_address FROM new_shipments;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Only rows whose fragment columns changed are written, so an address update
+    # never touches SHIPMENT_DETAILS_TABLE and a date update never touches the addresses
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION shipments_fragments_update()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            DELETE FROM SHIPMENT_DETAILS_TABLE d USING old_shipments o
+                WHERE d.shipping_id = o.shipping_id
+                AND o.shipping_id NOT IN (SELECT shipping_id FROM new_shipments);
+            DELETE FROM CUSTOMER_DETAILS_TABLE d USING old_shipments o
+                WHERE d.shipping_id = o.shipping_id
+                AND o.shipping_id NOT IN (SELECT shipping_id FROM new_shipments);
+
+            INSERT INTO SHIPMENT_DETAILS_TABLE
+                SELECT n.shipping_id, n.order_id, n.shipment_date
+                FROM new_shipments n LEFT JOIN old_shipments o USING (shipping_id)
+                WHERE (n.order_id, n.shipment_date) IS DISTINCT FROM (o.order_id, o.shipment_date)
+            ON CONFLICT (shipping_id) DO UPDATE
+                SET order_id = EXCLUDED.order_id, shipment_date = EXCLUDED.shipment_date;
+            INSERT INTO CUSTOMER_DETAILS_TABLE
+                SELECT n.shipping_id, n.customer_region, n.customer_shipping_address
+                FROM new_shipments n LEFT JOIN old_shipments o USING (shipping_id)
+                WHERE (n.customer_region, n.customer_shipping_address)
+                      IS DISTINCT FROM (o.customer_region, o.customer_shipping_address)
+            ON CONFLICT (shipping_id) DO UPDATE
+                SET customer_region = EXCLUDED.customer_region,
+                    customer_shipping_address = EXCLUDED.customer_shipping_address;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION shipments_fragments_delete()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            DELETE FROM SHIPMENT_DETAILS_TABLE d USING old_shipments o WHERE d.shipping_id = o.shipping_id;
+            DELETE FROM CUSTOMER_DETAILS_TABLE d USING old_shipments o WHERE d.shipping_id = o.shipping_id;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    cursor.execute("DROP TRIGGER IF EXISTS shipments_fragments_insert ON Shipments;")
+    cursor.execute("DROP TRIGGER IF EXISTS shipments_fragments_update ON Shipments;")
+    cursor.execute("DROP TRIGGER IF EXISTS shipments_fragments_delete ON Shipments;")
+
+    # Transition tables allow only one event per trigger
+    cursor.execute("""
+        CREATE TRIGGER shipments_fragments_insert
+        AFTER INSERT ON Shipments
+        REFERENCING NEW TABLE AS new_shipments
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION shipments_fragments_insert();
+    """)
+    cursor.execute("""
+        CREATE TRIGGER shipments_fragments_update
+        AFTER UPDATE ON Shipments
+        REFERENCING OLD TABLE AS old_shipments NEW TABLE AS new_shipments
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION shipments_fragments_update();
+    """)
+    cursor.execute("""
+        CREATE TRIGGER shipments_fragments_delete
+        AFTER DELETE ON Shipments
+        REFERENCING OLD TABLE AS old_shipments
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION shipments_fragments_delete();
+    """)
     print (" vertical partitioning done successfully!")
     conn.commit()
     cursor.close()
 
 
+def benchmark_vertical_partitioning(num_rows=10000000, scans=5, dbname='finalproject_bench'):
+    """Load num_rows shipments in a scratch database with the fragment triggers in place,
+       then compare a full scan of shipping dates over Shipments and over
+       SHIPMENT_DETAILS_TABLE"""
+    create_database(dbname)
+    with pooled_connection(dbname) as conn:
+        conn.autocommit = True
+        create_tables(conn)
+        vertical_partitioning(conn)
+        cursor = conn.cursor()
+        # Synthetic shipments have no orders behind them
+        cursor.execute("ALTER TABLE Shipments DROP CONSTRAINT IF EXISTS shipments_order_id_fkey;")
+
+        start = time.perf_counter()
+        cursor.execute("""
+            INSERT INTO Shipments (order_id, shipment_date, customer_shipping_address, customer_region)
+            SELECT i, current_date - (i %% 365), md5(i::text) || ' ' || md5((i + 1)::text),
+                   (ARRAY['LATAM', 'EMEA', 'APJ'])[i %% 3 + 1]
+            FROM generate_series(1, %s) AS i;
+        """, (num_rows,))
+        load_seconds = time.perf_counter() - start
+        cursor.execute("VACUUM ANALYZE Shipments, SHIPMENT_DETAILS_TABLE;")
+
+        results = {'rows': num_rows, 'load_seconds': load_seconds}
+        for table in ('Shipments', 'SHIPMENT_DETAILS_TABLE'):
+            cursor.execute("SELECT pg_relation_size(%s);", (table,))
+            size = cursor.fetchone()[0]
+            start = time.perf_counter()
+            for _ in range(scans):
+                cursor.execute(f"SELECT min(shipment_date), max(shipment_date), count(*) FROM {table};")
+                cursor.fetchone()
+            results[table] = {'bytes': size, 'scan_ms': (time.perf_counter() - start) / scans * 1000}
+        cursor.close()
+    close_pool(dbname)
+
+    print(f"\nVertical partitioning, {num_rows} shipments (loaded with propagation in {load_seconds:.1f}s)")
+    print("----------------------------------------------------")
+    for table in ('Shipments', 'SHIPMENT_DETAILS_TABLE'):
+        print(f"{table:<24} {results[table]['bytes'] / 2 ** 20:,.0f} MB, date scan {results[table]['scan_ms']:,.1f} ms")
+    return results
+
+
 # 
 
 def horizontal_partitioning(conn):
@@ -226,6 +952,127 @@ def horizontal_partitioning(conn):
     cursor.close()
 
 
+def declarative_horizontal_partitioning(conn):
+    """Recreate Products as a PARTITION BY RANGE table on a NUMERIC product_price.
+       Rows are routed by the planner instead of a trigger, range predicates prune
+       partitions, and prices outside 10-500 land in Products_default.
+       The partition key has to be part of the primary key, so OrderItems loses its
+       foreign key to Products(product_id)."""
+    cursor = conn.cursor()
+
+    cursor.execute("DROP TABLE IF EXISTS Products_10_to_100, Products_101_to_250, Products_251_to_500, Products_default;")
+    cursor.execute("DROP TABLE IF EXISTS Products CASCADE;")
+    cursor.execute("DROP FUNCTION IF EXISTS products_insert_trigger();")
+
+    cursor.execute("""
+        CREATE TABLE Products (
+            product_id SERIAL,
+            product_name VARCHAR(255),
+            product_price NUMERIC(10, 2) NOT NULL,
+            product_categories VARCHAR(255),
+            PRIMARY KEY (product_id, product_price)
+        ) PARTITION BY RANGE (product_price);
+    """)
+
+    # Bounds are [from, to); with two decimal places 100.01 is the first price above 100
+    cursor.execute("CREATE TABLE Products_10_to_100 PARTITION OF Products FOR VALUES FROM (10) TO (100.01);")
+    cursor.execute("CREATE TABLE Products_101_to_250 PARTITION OF Products FOR VALUES FROM (100.01) TO (250.01);")
+    cursor.execute("CREATE TABLE Products_251_to_500 PARTITION OF Products FOR VALUES FROM (250.01) TO (500.01);")
+    cursor.execute("CREATE TABLE Products_default PARTITION OF Products DEFAULT;")
+
+    print (" Declarative horizontal partitioning done successfully!")
+    conn.commit()
+    cursor.close()
+
+
+def benchmark_products_partitioning(num_rows=100000, queries=50, dbname='finalproject_bench'):
+    """Compare the INHERITS + trigger scheme with declarative partitioning in a scratch
+       database: insert throughput for num_rows products, then the mean latency of a
+       price-range count that only one partition can satisfy"""
+    rows = [(data[9], data[10], data[11]) for data in generate_random_batch(num_rows, seed=0)]
+    range_queries = {
+        'inherits': "SELECT count(*) FROM Products WHERE product_price::numeric > 120 AND product_price::numeric <= 200",
+        'declarative': "SELECT count(*) FROM Products WHERE product_price > 120 AND product_price <= 200",
+    }
+    results = {}
+
+    create_database(dbname)
+    with pooled_connection(dbname) as conn:
+        conn.autocommit = True
+        create_tables(conn)
+        cursor = conn.cursor()
+        for mode in ('inherits', 'declarative'):
+            if mode == 'inherits':
+                horizontal_partitioning(conn)
+            else:
+                declarative_horizontal_partitioning(conn)
+
+            start = time.perf_counter()
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO Products (product_name, product_price, product_categories) VALUES %s",
+                rows, page_size=1000)
+            insert_seconds = time.perf_counter() - start
+            cursor.execute("ANALYZE Products;")
+
+            start = time.perf_counter()
+            for _ in range(queries):
+                cursor.execute(range_queries[mode])
+                cursor.fetchone()
+            query_seconds = (time.perf_counter() - start) / queries
+
+            results[mode] = {'rows_per_sec': num_rows / insert_seconds, 'range_query_ms': query_seconds * 1000}
+        cursor.close()
+    close_pool(dbname)
+
+    print(f"\nProducts partitioning, {num_rows} rows")
+    print("----------------------------------------------------")
+    for mode, result in results.items():
+        print(f"{mode:<12} insert {result['rows_per_sec']:,.0f} rows/sec, range query {result['range_query_ms']:.2f} ms")
+    return results
+
+
+
+
+class SnowflakeIds:
+    """Roughly time-ordered 64-bit ids: 41 bits of milliseconds since SNOWFLAKE_EPOCH,
+       10 bits of worker id and a 12-bit sequence within the millisecond.
+       Each process owns one generator (ORDER_SEQUENCE) and a distinct worker id, so
+       no lock is shared between processes. When a millisecond runs out of sequence
+       numbers, or the clock steps back, ids borrow the following milliseconds rather
+       than wait."""
+
+    def __init__(self, worker_id=0):
+        if not 0 <= worker_id < 1 << SNOWFLAKE_WORKER_BITS:
+            raise ValueError(f"Worker id must be below {1 << SNOWFLAKE_WORKER_BITS}: {worker_id}")
+        self.worker_id = worker_id
+        self.last = -1  # (milliseconds << SNOWFLAKE_SEQUENCE_BITS) + sequence of the last id
+
+    def _reserve(self, count):
+        now = (time.time_ns() // 1000000 - SNOWFLAKE_EPOCH_MS) << SNOWFLAKE_SEQUENCE_BITS
+        first = max(now, self.last + 1)
+        self.last = first + count - 1
+        return first
+
+    def _compose(self, ticks):
+        return ((ticks >> SNOWFLAKE_SEQUENCE_BITS) << (SNOWFLAKE_WORKER_BITS + SNOWFLAKE_SEQUENCE_BITS)
+                | self.worker_id << SNOWFLAKE_SEQUENCE_BITS
+                | ticks & ((1 << SNOWFLAKE_SEQUENCE_BITS) - 1))
+
+    def next_id(self):
+        return self._compose(self._reserve(1))
+
+    def next_ids(self, count):
+        """Return count consecutive ids as a NumPy int64 array"""
+        return self._compose(self._reserve(count) + np.arange(count, dtype=np.int64))
+
+
+ORDER_SEQUENCE = SnowflakeIds(int(os.environ.get('SNOWFLAKE_WORKER_ID', os.getpid() % (1 << SNOWFLAKE_WORKER_BITS))))
+
+
+def set_worker_id(worker_id):
+    """Point this process's order_sequence_id generator at worker_id"""
+    global ORDER_SEQUENCE
+    ORDER_SEQUENCE = SnowflakeIds(worker_id % (1 << SNOWFLAKE_WORKER_BITS))
 
 
 # Define a function to generate random data
@@ -240,7 +1087,7 @@ def generate_random_data():
     order_date = fake.date_between(start_date='-30d', end_date='today') 
     quantity = random.randint(1, 10)
     price = random.randint(10, 500)
-    orderseq  = str(random.randint(1, 100000)) + str(int(time.time()))
+    orderseq  = ORDER_SEQUENCE.next_id()
     # product_name = fake.word()
     product_categories = random.choice([
         "Electronics",
@@ -270,56 +1117,518 @@ def generate_random_data():
 
 
 
-def insert_random_data(conn, num_records):
-    cursor = conn.cursor()
+def _data_pools(seed):
+    """Build (once per seed) the pools of names, emails and addresses
+       that generate_random_batch() draws from"""
+    if seed not in _DATA_POOLS:
+        if seed is not None:
+            _FAKER.seed_instance(seed)
+        _DATA_POOLS[seed] = {
+            'names': [_FAKER.name() for _ in range(DATA_POOL_SIZE)],
+            'emails': [_FAKER.email() for _ in range(DATA_POOL_SIZE)],
+            'addresses': [_FAKER.address() for _ in range(DATA_POOL_SIZE)],
+        }
+    return _DATA_POOLS[seed]
+
+
+def generate_random_batch(num_records, seed=None, today=None, chunk=None):
+    """Generate num_records records at once, in the same tuple layout as generate_random_data().
+       Names, emails and addresses are drawn from pools built by a single shared Faker and
+       every other field is drawn with NumPy, so a given seed and today always produce
+       the same batch, apart from the time-based order_sequence_id.
+       Chunks of one seeded load pass their chunk number: they share the seed's
+       pools and each gets its own NumPy stream."""
+    rng = np.random.default_rng(seed if seed is None or chunk is None else [seed, chunk])
+    pools = _data_pools(seed)
+    today = np.datetime64(today or date.today(), 'D')
+    categories = list(PRODUCT_CATALOG)
+
+    names = np.array(pools['names'], dtype=object)[rng.integers(0, DATA_POOL_SIZE, num_records)]
+    emails = np.array(pools['emails'], dtype=object)[rng.integers(0, DATA_POOL_SIZE, num_records)]
+    addresses = np.array(pools['addresses'], dtype=object)[rng.integers(0, DATA_POOL_SIZE, num_records)]
+    regions = np.array(REGIONS, dtype=object)[rng.integers(0, len(REGIONS), num_records)]
+    payment_modes = np.array(PAYMENT_MODES, dtype=object)[rng.integers(0, len(PAYMENT_MODES), num_records)]
+    category_index = rng.integers(0, len(categories), num_records)
+    product_categories = np.array(categories, dtype=object)[category_index]
+    catalog = np.array([PRODUCT_CATALOG[category] for category in categories], dtype=object)
+    product_names = catalog[category_index, rng.integers(0, catalog.shape[1], num_records)]
+
+    # Payment dates match Faker's date_of_birth(18, 65); shipments fall between order date and today
+    payment_dates = today - rng.integers(int(18 * 365.25), int(66 * 365.25), num_records).astype('timedelta64[D]')
+    order_offsets = rng.integers(0, 31, num_records)
+    shipment_offsets = (rng.random(num_records) * (order_offsets + 1)).astype(np.int64)
+    order_dates = today - order_offsets.astype('timedelta64[D]')
+    shipment_dates = today - shipment_offsets.astype('timedelta64[D]')
+
+    quantities = rng.integers(1, 11, num_records)
+    prices = rng.integers(10, 501, num_records)
+    product_prices = rng.integers(10, 501, num_records)
+    order_sequences = ORDER_SEQUENCE.next_ids(num_records)
+
+    return list(zip(names.tolist(), emails.tolist(), addresses.tolist(), regions.tolist(),
+                    payment_dates.astype(object).tolist(), payment_modes.tolist(),
+                    order_dates.astype(object).tolist(), quantities.tolist(), prices.tolist(),
+                    product_names.tolist(), product_prices.tolist(), product_categories.tolist(),
+                    shipment_dates.astype(object).tolist(), addresses.tolist(), regions.tolist(),
+                    order_sequences.tolist()))
+
+
+def benchmark_generation(num_records=10000, seed=0):
+    """Time generate_random_data() against generate_random_batch() for num_records records"""
+    start = time.perf_counter()
+    for _ in range(num_records):
+        generate_random_data()
+    per_record = time.perf_counter() - start
+
+    start = time.perf_counter()
+    generate_random_batch(num_records, seed=seed)
+    batched = time.perf_counter() - start
+
+    print(f"\nGenerating {num_records} records")
+    print("----------------------------------------------------")
+    print(f"generate_random_data:  {num_records / per_record:,.0f} records/sec")
+    print(f"generate_random_batch: {num_records / batched:,.0f} records/sec ({per_record / batched:.1f}x)")
+    return {'per_record_seconds': per_record, 'batch_seconds': batched}
+
+
+def registry_streams(seed):
+    """Independent NumPy generators for the customer and payment registries of one
+       load, so a seeded load does not pair customer k with payment k"""
+    customer_seed, payment_seed = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(customer_seed), np.random.default_rng(payment_seed)
+
+
+class KeyRegistry:
+    """Keys already inserted into a table, kept in process so foreign keys can be
+       sampled in O(1) instead of with ORDER BY random() on the server"""
+
+    def __init__(self, distribution='uniform', zipf_a=1.3, rng=None):
+        if distribution not in ('uniform', 'zipf'):
+            raise ValueError(f"Unknown key distribution: {distribution}")
+        self.keys = []
+        self.distribution = distribution
+        self.zipf_a = zipf_a
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        self.keys.append(key)
+
+    def add_many(self, keys):
+        self.keys.extend(keys)
+
+    def add_range(self, first, last):
+        """Register a contiguous block of keys, e.g. one reserved from a sequence"""
+        self.keys.extend(range(first, last + 1))
+
+    def sample(self, size=None):
+        """Return one key (or a list of size keys). Uniform draws treat every key alike;
+           zipf draws make the earliest registered keys the hot ones."""
+        if not self.keys:
+            return None if size is None else [None] * size
+        if self.distribution == 'zipf':
+            positions = (self.rng.zipf(self.zipf_a, size) - 1) % len(self.keys)
+        else:
+            positions = self.rng.integers(0, len(self.keys), size)
+        if size is None:
+            return self.keys[int(positions)]
+        return [self.keys[position] for position in positions.tolist()]
+
+
+# The statements insert_random_data() runs for every record, with $n placeholders
+HOT_STATEMENTS = {
+    'insert_customer': """
+        INSERT INTO Customer (customer_name, customer_email, customer_shipping_address, customer_region)
+        VALUES ($1, $2, $3, $4)
+        RETURNING customer_id
+    """,
+    'insert_payment': """
+        INSERT INTO Payments (payment_date, payment_mode)
+        VALUES ($1, $2)
+        RETURNING payment_id
+    """,
+    'insert_order': """
+        INSERT INTO Orders (order_id, customer_id, order_date, payment_id, quantity, order_sequence_id)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """,
+    'insert_product': """
+        INSERT INTO Products (product_name, product_price, product_categories)
+        VALUES ($1, $2, $3)
+    """,
+    'insert_shipment': """
+        INSERT INTO Shipments (order_id, shipment_date, customer_shipping_address, customer_region)
+        VALUES ($1, $2, $3, $4)
+    """,
+}
+
+_PLACEHOLDER = re.compile(r'\$\d+')
+
+
+class StatementCache:
+    """Server-side prepared statements, PREPAREd the first time they run on a
+       connection and EXECUTEd from then on, so the server parses and plans each
+       statement once per session instead of once per call"""
+
+    def __init__(self, statements=HOT_STATEMENTS):
+        self.statements = dict(statements)
+        self.hits = 0
+        self.misses = 0
+        # Keyed weakly by the connection itself: a set dies with its session, and a
+        # new connection never inherits the names prepared on an old one
+        self._prepared = weakref.WeakKeyDictionary()
+
+    def execute(self, cursor, name, params):
+        conn = cursor.connection
+        prepared = self._prepared.setdefault(conn, set())
+        if name in prepared:
+            self.hits += 1
+        else:
+            cursor.execute(f"PREPARE {name} AS {self.statements[name]}")
+            prepared.add(name)
+            self.misses += 1
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
 
-    for i in range(num_records):
-        data = generate_random_data()
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
 
-        cursor.execute("""
-            INSERT INTO Customer (customer_name, customer_email, customer_shipping_address, customer_region)
-            VALUES (%s, %s, %s, %s)
-        """, (data[0], data[1], data[2], data[3]))
 
-        cursor.execute("""
-            INSERT INTO Payments (payment_date, payment_mode)
-            VALUES (%s, %s)
-        """, (data[4], data[5]))
+STATEMENT_CACHE = StatementCache()
 
-        cursor.execute("""
-            INSERT INTO Orders (order_id, customer_id, order_date, payment_id, quantity, order_sequence_id)
-            VALUES (%s, (SELECT customer_id FROM Customer ORDER BY random() LIMIT 1), %s, (SELECT payment_id FROM Payments ORDER BY random() LIMIT 1), %s, %s)
-        """, (i, data[6], data[7], data[15]))
 
-        cursor.execute("""
-            INSERT INTO Products (product_name, product_price, product_categories)
-            VALUES (%s, %s, %s)
-        """, (data[9], data[10], data[11]))
+def execute_statement(cursor, name, params, statement_cache=None):
+    """Run one of HOT_STATEMENTS, through statement_cache when one is given"""
+    if statement_cache is not None:
+        statement_cache.execute(cursor, name, params)
+    else:
+        cursor.execute(_PLACEHOLDER.sub('%s', HOT_STATEMENTS[name]), params)
 
-        cursor.execute("""
-            INSERT INTO Shipments (order_id, shipment_date, customer_shipping_address, customer_region)
-            VALUES (%s, %s, %s, %s)
-        """, (i, data[12], data[13], data[14]))
+
+def insert_random_data(conn, num_records, customers=None, payments=None, partition_mode='inherits',
+                       statement_cache=STATEMENT_CACHE, records=None):
+    """Insert num_records generated records one statement at a time.
+       Orders reference customers and payments sampled from the key registries,
+       which are filled from the ids returned by each insert.
+       The hot inserts run as prepared statements from statement_cache; pass None
+       to send them as plain queries. records, if given, replaces the generated
+       data with pre-built tuples in the generate_random_data() layout.
+       With partition_mode='declarative' Postgres routes products itself, so the
+       explicit copy into the price partitions is skipped."""
+    cursor = conn.cursor()
+    customers = customers if customers is not None else KeyRegistry()
+    payments = payments if payments is not None else KeyRegistry()
+
+    if records is None:
+        records = (generate_random_data() for _ in range(num_records))
+
+    for i, data in enumerate(records):
+        execute_statement(cursor, 'insert_customer', (data[0], data[1], data[2], data[3]), statement_cache)
+        # A BEFORE trigger that redirects the row returns nothing to register
+        row = cursor.fetchone()
+        if row is not None:
+            customers.add(row[0])
+
+        execute_statement(cursor, 'insert_payment', (data[4], data[5]), statement_cache)
+        payments.add(cursor.fetchone()[0])
+
+        execute_statement(cursor, 'insert_order', (i, customers.sample(), data[6], payments.sample(), data[7], data[15]),
+                          statement_cache)
+        execute_statement(cursor, 'insert_product', (data[9], data[10], data[11]), statement_cache)
+        execute_statement(cursor, 'insert_shipment', (i, data[12], data[13], data[14]), statement_cache)
 
         # Route the data to the appropriate partitioned table based on product_price
-        if 10 <= data[10] <= 100:
-            cursor.execute("INSERT INTO Products_10_to_100 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
-                           (data[9], data[10], data[11]))
-        elif 101 <= data[10] <= 250:
-            cursor.execute("INSERT INTO Products_101_to_250 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
-                           (data[9], data[10], data[11]))
-        elif 251 <= data[10] <= 500:
-            cursor.execute("INSERT INTO Products_251_to_500 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
-                           (data[9], data[10], data[11]))
-        else:
-            # Handle data that doesn't fit into any partition
-            print("Data out of range: ", data[10])
+        if partition_mode == 'inherits':
+            if 10 <= data[10] <= 100:
+                cursor.execute("INSERT INTO Products_10_to_100 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
+                               (data[9], data[10], data[11]))
+            elif 101 <= data[10] <= 250:
+                cursor.execute("INSERT INTO Products_101_to_250 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
+                               (data[9], data[10], data[11]))
+            elif 251 <= data[10] <= 500:
+                cursor.execute("INSERT INTO Products_251_to_500 (product_name, product_price, product_categories) VALUES (%s, %s, %s)",
+                               (data[9], data[10], data[11]))
+            else:
+                # Handle data that doesn't fit into any partition
+                print("Data out of range: ", data[10])
 
     conn.commit()
     cursor.close()
     print(f"Inserted {num_records} rows of data into the tables.")
 
 
+def _copy_escape(value):
+    """Render a value in COPY text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Stream rows into table through COPY ... FROM STDIN
+       Return the number of rows copied"""
+    buffer = io.StringIO()
+    count = 0
+    for row in rows:
+        buffer.write('\t'.join(_copy_escape(value) for value in row))
+        buffer.write('\n')
+        count += 1
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+    return count
+
+
+def reserve_ids(cursor, table, column, count):
+    """Draw count values from the serial sequence behind table.column
+       so rows can be copied with their keys already known"""
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                   (table, column, count))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _timed_copy(cursor, stats, table, columns, rows):
+    start = time.perf_counter()
+    count = copy_rows(cursor, table, columns, rows)
+    stats[table]['rows'] += count
+    stats[table]['seconds'] += time.perf_counter() - start
+
+
+def print_load_stats(stats):
+    """Print rows/sec for every table of a load"""
+    print("\nTable            rows        seconds     rows/sec")
+    print("----------------------------------------------------")
+    for table, entry in stats.items():
+        rate = entry['rows'] / entry['seconds'] if entry['seconds'] else 0.0
+        print(f"{table:<16} {entry['rows']:<11} {entry['seconds']:<11.3f} {rate:,.0f}")
+
+
+# Columns the bulk and async loaders write, per table, in load order
+LOAD_COLUMNS = {
+    'Customer': ('customer_id', 'customer_name', 'customer_email', 'customer_shipping_address', 'customer_region'),
+    'Payments': ('payment_id', 'payment_date', 'payment_mode'),
+    'Orders': ('order_id', 'customer_id', 'order_date', 'payment_id', 'quantity', 'price', 'order_sequence_id'),
+    'Products': ('product_name', 'product_price', 'product_categories'),
+    'Shipments': ('order_id', 'shipment_date', 'customer_shipping_address', 'customer_region'),
+}
+
+
+def _record_rows(records, customer_ids, payment_ids, order_ids, customers, payments):
+    """Split generated records into per-table rows in LOAD_COLUMNS order.
+       The reserved customer and payment ids are registered first, so orders may
+       reference this batch as well as earlier ones."""
+    customers.add_many(customer_ids)
+    payments.add_many(payment_ids)
+    count = len(records)
+    return {
+        'Customer': [(customer_id, data[0], data[1], data[2], data[3])
+                     for customer_id, data in zip(customer_ids, records)],
+        'Payments': [(payment_id, data[4], data[5]) for payment_id, data in zip(payment_ids, records)],
+        'Orders': [(order_id, customer_id, data[6], payment_id, data[7], data[8], data[15])
+                   for order_id, customer_id, payment_id, data in zip(order_ids, customers.sample(count),
+                                                                       payments.sample(count), records)],
+        # In category order: with INHERITS routing every product row upserts the category
+        # rollup on its own, and concurrent loads must take those row locks in one order
+        'Products': sorted(((data[9], data[10], data[11]) for data in records), key=lambda row: row[2]),
+        'Shipments': [(order_id, data[12], data[13], data[14]) for order_id, data in zip(order_ids, records)],
+    }
+
+
+def bulk_insert_random_data(conn, num_records, chunk_size=BULK_CHUNK_SIZE, start_order_id=0, seed=None,
+                            customers=None, payments=None, verbose=True):
+    """Bulk-load num_records generated records with COPY, chunk_size records at a time.
+       Customer and payment ids are reserved from their sequences and registered before
+       the chunk is copied, so every order references a customer and payment that is
+       already loaded. Return per-table row counts and seconds spent copying."""
+    cursor = conn.cursor()
+    customer_rng, payment_rng = registry_streams(seed)
+    customers = customers if customers is not None else KeyRegistry(rng=customer_rng)
+    payments = payments if payments is not None else KeyRegistry(rng=payment_rng)
+    stats = {table: {'rows': 0, 'seconds': 0.0} for table in LOAD_COLUMNS}
+
+    for offset in range(0, num_records, chunk_size):
+        count = min(chunk_size, num_records - offset)
+        records = generate_random_batch(count, seed=seed, chunk=offset)
+        customer_ids = reserve_ids(cursor, 'customer', 'customer_id', count)
+        payment_ids = reserve_ids(cursor, 'payments', 'payment_id', count)
+        order_ids = range(start_order_id + offset, start_order_id + offset + count)
+
+        rows = _record_rows(records, customer_ids, payment_ids, order_ids, customers, payments)
+        for table, columns in LOAD_COLUMNS.items():
+            _timed_copy(cursor, stats, table, columns, rows[table])
+        conn.commit()
+
+    cursor.close()
+    if verbose:
+        print(f"Bulk loaded {num_records} rows of data into the tables.")
+        print_load_stats(stats)
+    return stats
+
+
+def _ingest_worker(task):
+    """Load one disjoint order_id range on the worker's own connection"""
+    dbname, worker, start_order_id, num_records, chunk_size, seed, distribution, worker_id = task
+    set_worker_id(worker_id)
+    with pooled_connection(dbname) as conn:
+        start = time.perf_counter()
+        customer_rng, payment_rng = registry_streams(seed)
+        customers = KeyRegistry(distribution, rng=customer_rng)
+        payments = KeyRegistry(rng=payment_rng)
+        stats = bulk_insert_random_data(conn, num_records, chunk_size=chunk_size, start_order_id=start_order_id,
+                                        seed=seed, customers=customers, payments=payments, verbose=False)
+        return worker, stats, time.perf_counter() - start
+
+
+def parallel_insert_random_data(dbname, num_records, workers=None, chunk_size=BULK_CHUNK_SIZE, seed=None,
+                                distribution='uniform'):
+    """Split a bulk load across a process pool. Worker i owns order ids
+       [start_i, start_i + count_i) and its own connection; per-worker stats are
+       merged into one report. Return the merged per-table stats."""
+    workers = workers or multiprocessing.cpu_count()
+    per_worker, remainder = divmod(num_records, workers)
+    tasks = []
+    start_order_id = 0
+    for worker in range(workers):
+        count = per_worker + (1 if worker < remainder else 0)
+        worker_seed = None if seed is None else seed + worker * 1000003
+        # Worker ids follow the parent's so no two processes stamp the same order_sequence_id
+        tasks.append((dbname, worker, start_order_id, count, chunk_size, worker_seed, distribution,
+                      ORDER_SEQUENCE.worker_id + 1 + worker))
+        start_order_id += count
+
+    merged = {}
+    start = time.perf_counter()
+    # spawn, not fork: children must not inherit the parent's open connection
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for done, (worker, stats, elapsed) in enumerate(pool.imap_unordered(_ingest_worker, tasks), 1):
+            print(f"Worker {worker} finished {stats['Orders']['rows']} records in {elapsed:.2f}s ({done}/{workers})")
+            for table, entry in stats.items():
+                total = merged.setdefault(table, {'rows': 0, 'seconds': 0.0})
+                total['rows'] += entry['rows']
+                total['seconds'] += entry['seconds']
+    wall = time.perf_counter() - start
+
+    # Per-table seconds are summed across workers, so the rates below are per worker
+    print(f"\nParallel load of {num_records} records with {workers} workers took {wall:.2f}s "
+          f"({num_records / wall:,.0f} records/sec)")
+    print_load_stats(merged)
+    return merged
+
+
+
+
+def drop_secondary_indexes(conn):
+    """Drop every index in the public schema that does not back a constraint
+       Return their definitions for rebuild_secondary_indexes()"""
+    cursor = conn.cursor()
+    # Partition indexes go away with their parent and come back with it
+    cursor.execute("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid), c.relkind
+        FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relnamespace = 'public'::regnamespace
+        AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)
+        AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = i.indexrelid);
+    """)
+    indexes = cursor.fetchall()
+    for name, _, _ in indexes:
+        cursor.execute(f"DROP INDEX {name};")
+    conn.commit()
+    cursor.close()
+    # pg_get_indexdef() gives a partitioned index as ON ONLY, which would rebuild it
+    # invalid and without partition indexes; without ONLY it cascades to every partition
+    return [definition.replace(" ON ONLY ", " ON ", 1) if relkind == 'I' else definition
+            for _, definition, relkind in indexes]
+
+
+def drop_foreign_keys(conn):
+    """Drop every foreign key in the public schema
+       Return (table, constraint, definition) tuples for restore_foreign_keys()"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT con.conrelid::regclass::text, con.conname, pg_get_constraintdef(con.oid), c.relkind
+        FROM pg_constraint con JOIN pg_class c ON c.oid = con.conrelid
+        WHERE con.contype = 'f' AND con.connamespace = 'public'::regnamespace AND con.conparentid = 0;
+    """)
+    foreign_keys = cursor.fetchall()
+    for table, name, _, _ in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name};")
+    conn.commit()
+    cursor.close()
+    return foreign_keys
+
+
+def _run_in_parallel(dbname, statements, parallel):
+    """Execute each statement on its own pooled connection, parallel at a time,
+       with maintenance_work_mem split across the concurrent builds"""
+    work_mem_mb = max(64, FAST_LOAD_MAINTENANCE_WORK_MEM_MB // parallel)
+
+    def run(statement):
+        with pooled_connection(dbname) as conn:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute(f"SET maintenance_work_mem = '{work_mem_mb}MB';")
+            cursor.execute(statement)
+            cursor.close()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+        for future in [executor.submit(run, statement) for statement in statements]:
+            future.result()
+
+
+def rebuild_secondary_indexes(dbname, definitions, parallel=FAST_LOAD_PARALLELISM):
+    """Recreate indexes dropped by drop_secondary_indexes(), several at once"""
+    _run_in_parallel(dbname, definitions, parallel)
+
+
+def restore_foreign_keys(dbname, foreign_keys, parallel=FAST_LOAD_PARALLELISM):
+    """Add the foreign keys back as NOT VALID, which is instant, then check the
+       existing rows with VALIDATE CONSTRAINT in parallel. Partitioned tables do not
+       support NOT VALID foreign keys, so theirs are added and checked in one step."""
+    with pooled_connection(dbname) as conn:
+        cursor = conn.cursor()
+        for table, name, definition, relkind in foreign_keys:
+            not_valid = "" if relkind == 'p' else " NOT VALID"
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}{not_valid};")
+        conn.commit()
+        cursor.close()
+    _run_in_parallel(dbname, [f"ALTER TABLE {table} VALIDATE CONSTRAINT {name};"
+                              for table, name, _, relkind in foreign_keys if relkind != 'p'], parallel)
+
+
+def fast_load(conn, load, dbname=DATABASE_NAME, parallel=FAST_LOAD_PARALLELISM):
+    """Run load(conn) with secondary indexes and foreign keys out of the way, then
+       rebuild the indexes and re-validate the keys in parallel. The indexes and keys
+       are put back even if load(conn) raises.
+       Return the seconds spent in each phase"""
+    timings = {}
+    start = time.perf_counter()
+    indexes = drop_secondary_indexes(conn)
+    foreign_keys = drop_foreign_keys(conn)
+    timings['drop'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        load(conn)
+    except Exception:
+        # Release the failed load's locks before other connections rebuild
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+    finally:
+        timings['load'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rebuild_secondary_indexes(dbname, indexes, parallel)
+        timings['rebuild_indexes'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        restore_foreign_keys(dbname, foreign_keys, parallel)
+        timings['validate_foreign_keys'] = time.perf_counter() - start
+
+    print(f" Fast load: {len(indexes)} indexes and {len(foreign_keys)} foreign keys deferred; "
+          + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in timings.items()))
+    return timings
 
 
 def create_replicated_tables(conn):
@@ -350,7 +1659,14 @@ def create_replicated_tables(conn):
     cursor.close()
 
 
-def create_replication_trigger(conn):
+def create_replication_trigger(conn, mode='statement'):
+    """Replicate new Customer rows into the Customer_Region_* tables.
+       mode='row'       one INSERT per customer from a FOR EACH ROW trigger
+       mode='statement' three set-based INSERTs per statement from the transition table
+       mode='deferred'  only queue the new customer ids; apply_pending_replication()
+                        copies them later in batches"""
+    if mode not in ('row', 'statement', 'deferred'):
+        raise ValueError(f"Unknown replication mode: {mode}")
     cursor = conn.cursor()
 
     # Trigger function for replication
@@ -370,105 +1686,1049 @@ def create_replication_trigger(conn):
         $$ LANGUAGE plpgsql;
     """)
 
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION replicate_customer_statement()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO Customer_Region_LATAM SELECT * FROM new_customers WHERE customer_region = 'LATAM';
+            INSERT INTO Customer_Region_EMEA SELECT * FROM new_customers WHERE customer_region = 'EMEA';
+            INSERT INTO Customer_Region_APJ SELECT * FROM new_customers WHERE customer_region = 'APJ';
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Customer_Replication_Queue (
+            customer_id INT PRIMARY KEY
+        );
+    """)
+
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION enqueue_customer_replication()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO Customer_Replication_Queue SELECT customer_id FROM new_customers;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
     cursor.execute("DROP TRIGGER IF EXISTS replicate_customer_trigger ON Customer;")
     
     # Trigger to call the replication function
-    cursor.execute("""
-        CREATE TRIGGER replicate_customer_trigger
-        BEFORE INSERT ON Customer
-        FOR EACH ROW
-        EXECUTE FUNCTION replicate_customer_trigger();
-    """)
+    if mode == 'row':
+        cursor.execute("""
+            CREATE TRIGGER replicate_customer_trigger
+            AFTER INSERT ON Customer
+            FOR EACH ROW
+            EXECUTE FUNCTION replicate_customer_trigger();
+        """)
+    elif mode == 'statement':
+        cursor.execute("""
+            CREATE TRIGGER replicate_customer_trigger
+            AFTER INSERT ON Customer
+            REFERENCING NEW TABLE AS new_customers
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION replicate_customer_statement();
+        """)
+    else:
+        cursor.execute("""
+            CREATE TRIGGER replicate_customer_trigger
+            AFTER INSERT ON Customer
+            REFERENCING NEW TABLE AS new_customers
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION enqueue_customer_replication();
+        """)
 
     conn.commit()
     cursor.close()
-    print (" Replaction  done successfully!")
+    print (f" Replaction ({mode})  done successfully!")
+
+
+def apply_pending_replication(conn, batch_size=10000):
+    """Drain Customer_Replication_Queue into the regional tables, batch_size customers
+       per transaction. Safe to run from several sessions at once.
+       Return the number of customers replicated."""
+    cursor = conn.cursor()
+    total = 0
+    while True:
+        cursor.execute("""
+            WITH batch AS (
+                DELETE FROM Customer_Replication_Queue
+                WHERE customer_id IN (
+                    SELECT customer_id FROM Customer_Replication_Queue
+                    ORDER BY customer_id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING customer_id
+            ), pending AS (
+                SELECT c.* FROM Customer c JOIN batch USING (customer_id)
+            ), latam AS (
+                INSERT INTO Customer_Region_LATAM SELECT * FROM pending WHERE customer_region = 'LATAM'
+                ON CONFLICT DO NOTHING
+            ), emea AS (
+                INSERT INTO Customer_Region_EMEA SELECT * FROM pending WHERE customer_region = 'EMEA'
+                ON CONFLICT DO NOTHING
+            ), apj AS (
+                INSERT INTO Customer_Region_APJ SELECT * FROM pending WHERE customer_region = 'APJ'
+                ON CONFLICT DO NOTHING
+            )
+            SELECT count(*) FROM batch;
+        """, (batch_size,))
+        applied = cursor.fetchone()[0]
+        conn.commit()
+        if applied == 0:
+            break
+        total += applied
+    cursor.close()
+    print(f" Applied replication for {total} customers")
+    return total
+
+class RegionRouter:
+    """Send customer queries to the Customer_Region_* fragments instead of Customer.
+       Queries name the fragment as {table}. A query for one region reads only that
+       region's table; a global query runs on every fragment in parallel, each on its
+       own pooled connection, and the partial results are merged here."""
+
+    AGGREGATES = ('count', 'sum', 'min', 'max', 'avg')
+
+    def __init__(self, dbname=DATABASE_NAME):
+        self.dbname = dbname
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(REGION_TABLES))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown()
+
+    def query_region(self, region, query, params=None):
+        """Run query against the fragment of a single region"""
+        if region not in REGION_TABLES:
+            raise ValueError(f"Unknown region: {region}")
+        with pooled_connection(self.dbname) as conn:
+            cursor = conn.cursor()
+            cursor.execute(query.format(table=REGION_TABLES[region]), params)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.commit()
+        return rows
+
+    def scatter(self, query, params=None, regions=REGIONS):
+        """Run query against several fragments at once
+           Return the rows per region"""
+        futures = {region: self._executor.submit(self.query_region, region, query, params) for region in regions}
+        return {region: future.result() for region, future in futures.items()}
+
+    def query_all(self, query, params=None, order_by=None, descending=False, limit=None):
+        """Run query on every fragment and merge the rows. With order_by (a column
+           position) the query must sort by that column itself, and the sorted runs are
+           merged; with limit the query should apply the same LIMIT, since no fragment
+           can contribute more rows than that."""
+        runs = self.scatter(query, params).values()
+        if order_by is None:
+            rows = (row for run in runs for row in run)
+        else:
+            rows = heapq.merge(*runs, key=lambda row: row[order_by], reverse=descending)
+        return list(itertools.islice(rows, limit))
+
+    def aggregate_all(self, aggregates, where="TRUE", params=None, group_by=()):
+        """Compute aggregates over all regions from per-fragment partial aggregates.
+           aggregates maps an output name to (function, column), with function one of
+           count, sum, min, max or avg. Return one dict per group."""
+        select = list(group_by)
+        for function, column in aggregates.values():
+            if function not in self.AGGREGATES:
+                raise ValueError(f"Unsupported aggregate: {function}")
+            if function == 'avg':
+                select += [f"sum({column})", f"count({column})"]
+            else:
+                select.append(f"{function}({column})")
+        query = f"SELECT {', '.join(select)} FROM {{table}} WHERE {where}"
+        if group_by:
+            query += f" GROUP BY {', '.join(group_by)}"
+
+        groups = {}
+        for run in self.scatter(query, params).values():
+            for row in run:
+                key, values = tuple(row[:len(group_by)]), list(row[len(group_by):])
+                partials = groups.setdefault(key, {})
+                for name, (function, _) in aggregates.items():
+                    if function == 'avg':
+                        partial = (values.pop(0) or 0, values.pop(0))
+                        previous = partials.get(name, (0, 0))
+                        partials[name] = (previous[0] + partial[0], previous[1] + partial[1])
+                        continue
+                    value = values.pop(0)
+                    previous = partials.get(name)
+                    if previous is None or value is None:
+                        partials[name] = value if previous is None else previous
+                    elif function in ('count', 'sum'):
+                        partials[name] = previous + value
+                    elif function == 'min':
+                        partials[name] = min(previous, value)
+                    else:
+                        partials[name] = max(previous, value)
+
+        results = []
+        for key, partials in groups.items():
+            result = dict(zip(group_by, key))
+            for name, (function, _) in aggregates.items():
+                if function == 'avg':
+                    total, count = partials[name]
+                    result[name] = total / count if count else None
+                else:
+                    result[name] = partials[name]
+            results.append(result)
+        return results
+
+    def find_customer(self, region, customer_id):
+        """Look a customer up by id in its own region's table"""
+        rows = self.query_region(region, "SELECT * FROM {table} WHERE customer_id = %s", (customer_id,))
+        return rows[0] if rows else None
+
+    def find_customers_by_name(self, customer_name, region=None):
+        """Customers with an exact name, from one region's table or from all of them"""
+        query = "SELECT * FROM {table} WHERE customer_name = %s ORDER BY customer_id"
+        if region is not None:
+            return self.query_region(region, query, (customer_name,))
+        return self.query_all(query, (customer_name,), order_by=0)
+
 
 def IndexCreation(conn):
     cursor = conn.cursor()
 
     cursor.execute("""
-CREATE INDEX customer_name_apj ON customer_region_apj(customer_name)
+CREATE INDEX IF NOT EXISTS customer_name_apj ON customer_region_apj(customer_name)
     """)
 
     # Trigger function for replication
     cursor.execute("""
-CREATE INDEX customer_name_emea ON customer_region_emea(customer_name)
+CREATE INDEX IF NOT EXISTS customer_name_emea ON customer_region_emea(customer_name)
     """)
 
     cursor.execute("""
-CREATE INDEX customer_name_latam ON customer_region_latam(customer_name)
+CREATE INDEX IF NOT EXISTS customer_name_latam ON customer_region_latam(customer_name)
     """)
 
     cursor.execute("""
-CREATE INDEX customer_name_ ON customer(customer_name)
+CREATE INDEX IF NOT EXISTS customer_name_ ON customer(customer_name)
     """)
     print (" Index Creation  done successfully!")
-def retrieve_data(conn):
+
+
+# (index name, table, key columns and INCLUDE list, partial index predicate)
+WORKLOAD_INDEXES = (
+    ('orders_customer_id', 'Orders', '(customer_id) INCLUDE (order_id)', 'customer_id IS NOT NULL'),
+    ('orders_payment_id', 'Orders', '(payment_id)', 'payment_id IS NOT NULL'),
+    ('shipments_order_id', 'Shipments', '(order_id) INCLUDE (shipment_date)', None),
+    ('orderitems_order_sequence_id', 'OrderItems', '(order_sequence_id)', None),
+    ('orderitems_product_id', 'OrderItems', '(product_id)', None),
+    ('products_categories', 'Products', '(product_categories) INCLUDE (product_price)', None),
+)
+
+TOP_CUSTOMERS_QUERY = """
+    SELECT
+        c.customer_name,
+        COUNT(o.order_id) AS total_orders
+    FROM
+        Customer c
+        JOIN Orders o ON c.customer_id = o.customer_id
+    GROUP BY
+        c.customer_name
+    ORDER BY
+        total_orders DESC
+    LIMIT 3;
+"""
+
+CATEGORY_AVERAGE_PRICE_QUERY = """
+    SELECT
+        p.product_categories,
+        AVG(p.product_price::numeric) AS average_price
+    FROM
+        Products p
+    GROUP BY
+        p.product_categories
+    ORDER BY
+        average_price DESC;
+"""
+
+PROJECT_QUERIES = {
+    'top_customers': TOP_CUSTOMERS_QUERY,
+    'category_average_price': CATEGORY_AVERAGE_PRICE_QUERY,
+    'orders_of_customer': "SELECT order_id FROM Orders WHERE customer_id = 1;",
+    'orders_of_payment': "SELECT order_id FROM Orders WHERE payment_id = 1;",
+    'shipment_of_order': "SELECT shipment_date FROM Shipments WHERE order_id = 1;",
+    'products_in_category': "SELECT count(*), AVG(product_price::numeric) FROM Products WHERE product_categories = 'Electronics';",
+}
+
+
+def explain_queries(conn, queries=PROJECT_QUERIES):
+    """Run each query under EXPLAIN ANALYZE
+       Return the server-side execution time in ms per query name"""
+    cursor = conn.cursor()
+    timings = {}
+    for name, query in queries.items():
+        cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+        timings[name] = cursor.fetchone()[0][0]['Execution Time']
+    conn.commit()
+    cursor.close()
+    return timings
+
+
+def _drop_invalid_index(cursor, name):
+    """A failed CREATE INDEX CONCURRENTLY leaves an invalid index behind that
+       IF NOT EXISTS would otherwise keep forever"""
+    cursor.execute("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s);", (name,))
+    row = cursor.fetchone()
+    if row and row[0]:
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name};")
+
+
+def _create_index_concurrently(cursor, name, table, columns, where):
+    """Build one index without blocking writes. Partitioned tables get the index
+       ON ONLY the parent plus one concurrently built index attached per partition;
+       INHERITS children get their own copy since parent indexes do not cover them."""
+    predicate = f" WHERE {where}" if where else ""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass;", (table,))
+    relkind = cursor.fetchone()[0]
+    cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = %s::regclass;", (table,))
+    children = [row[0] for row in cursor.fetchall()]
+
+    if relkind == 'p':
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}{predicate};")
+    else:
+        _drop_invalid_index(cursor, name)
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {columns}{predicate};")
+
+    for child in children:
+        if relkind == 'p':
+            # Partitions added after the parent index already carry an attached clone of it
+            cursor.execute("""
+                SELECT 1 FROM pg_inherits JOIN pg_index ON indexrelid = inhrelid
+                WHERE indrelid = %s::regclass AND inhparent = to_regclass(%s);
+            """, (child, name))
+            if cursor.fetchone() is not None:
+                continue
+        child_index = f"{name}_{child}"[:63]
+        _drop_invalid_index(cursor, child_index)
+        cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child_index} ON {child} {columns}{predicate};")
+        if relkind == 'p':
+            cursor.execute("""
+                SELECT 1 FROM pg_inherits
+                WHERE inhrelid = %s::regclass AND inhparent = %s::regclass;
+            """, (child_index, name))
+            if cursor.fetchone() is None:
+                cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child_index};")
+
+
+def create_workload_indexes(conn, indexes=WORKLOAD_INDEXES):
+    """Index the foreign keys and filters the project's queries use, with
+       CREATE INDEX CONCURRENTLY so reads and writes continue during the build.
+       Safe to run repeatedly. Print and return EXPLAIN ANALYZE timings of
+       PROJECT_QUERIES from before and after the build."""
+    # CONCURRENTLY cannot run inside a transaction block
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor()
+        before = explain_queries(conn)
+        for name, table, columns, where in indexes:
+            _create_index_concurrently(cursor, name, table, columns, where)
+        cursor.execute(f"ANALYZE {', '.join(sorted({table for _, table, _, _ in indexes}))};")
+        after = explain_queries(conn)
+    finally:
+        cursor.close()
+        conn.autocommit = autocommit
+
+    print("\nQuery                      before (ms)   after (ms)")
+    print("----------------------------------------------------")
+    for name in before:
+        print(f"{name:<26} {before[name]:>11.3f} {after[name]:>12.3f}")
+    print (" Workload index creation done successfully!")
+    return {'before': before, 'after': after}
+
+
+def create_rollups(conn):
+    """Create the rollup tables behind retrieve_data(use_rollups=True) and the
+       statement-level triggers that fold every insert into Orders and Products into them:
+       Customer_Order_Counts holds orders per customer, Category_Price_Stats holds the
+       price sum and count per category. Run before loading; rebuild_rollups() covers
+       data that is already there."""
+    cursor = conn.cursor()
 
-        # Query 1: Retrieve top 3 customers based on the number of orders placed
-        cursor.execute("""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Customer_Order_Counts (
+            customer_id INT PRIMARY KEY,
+            customer_name VARCHAR(255),
+            order_count BIGINT NOT NULL
+        );
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS customer_order_counts_count ON Customer_Order_Counts (order_count DESC);")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS Category_Price_Stats (
+            product_categories VARCHAR(255) PRIMARY KEY,
+            price_sum NUMERIC NOT NULL,
+            price_count BIGINT NOT NULL
+        );
+    """)
+
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION rollup_new_orders()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO Customer_Order_Counts
+                SELECT n.customer_id, c.customer_name, count(n.order_id)
+                FROM new_orders n JOIN Customer c ON c.customer_id = n.customer_id
+                GROUP BY n.customer_id, c.customer_name
+                ORDER BY n.customer_id
+            ON CONFLICT (customer_id) DO UPDATE
+                SET order_count = Customer_Order_Counts.order_count + EXCLUDED.order_count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    cursor.execute("""
+        CREATE OR REPLACE FUNCTION rollup_new_products()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            INSERT INTO Category_Price_Stats
+                SELECT product_categories, coalesce(sum(product_price::numeric), 0), count(product_price)
+                FROM new_products
+                WHERE product_categories IS NOT NULL
+                GROUP BY product_categories
+                ORDER BY product_categories
+            ON CONFLICT (product_categories) DO UPDATE
+                SET price_sum = Category_Price_Stats.price_sum + EXCLUDED.price_sum,
+                    price_count = Category_Price_Stats.price_count + EXCLUDED.price_count;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    cursor.execute("DROP TRIGGER IF EXISTS rollup_new_orders ON Orders;")
+    cursor.execute("""
+        CREATE TRIGGER rollup_new_orders
+        AFTER INSERT ON Orders
+        REFERENCING NEW TABLE AS new_orders
+        FOR EACH STATEMENT
+        EXECUTE FUNCTION rollup_new_orders();
+    """)
+
+    # A declaratively partitioned Products reports routed rows in its own transition
+    # table; with INHERITS the rows only ever reach the child tables
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'products'::regclass;")
+    tables = ['Products']
+    if cursor.fetchone()[0] != 'p':
+        cursor.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'products'::regclass;")
+        tables += [row[0] for row in cursor.fetchall()]
+    for table in tables:
+        cursor.execute(f"DROP TRIGGER IF EXISTS rollup_new_products ON {table};")
+        cursor.execute(f"""
+            CREATE TRIGGER rollup_new_products
+            AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_products
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION rollup_new_products();
+        """)
+
+    conn.commit()
+    cursor.close()
+    print (" Rollups created successfully!")
+
+
+_ROLLUP_BASE_QUERIES = {
+    'Customer_Order_Counts': """
+        SELECT c.customer_id, c.customer_name, count(o.order_id)
+        FROM Customer c JOIN Orders o ON c.customer_id = o.customer_id
+        GROUP BY c.customer_id, c.customer_name
+    """,
+    'Category_Price_Stats': """
+        SELECT product_categories, coalesce(sum(product_price::numeric), 0), count(product_price)
+        FROM Products
+        WHERE product_categories IS NOT NULL
+        GROUP BY product_categories
+    """,
+}
+
+
+def rebuild_rollups(conn):
+    """Recompute both rollup tables from the base tables"""
+    cursor = conn.cursor()
+    for table, query in _ROLLUP_BASE_QUERIES.items():
+        cursor.execute(f"TRUNCATE {table};")
+        cursor.execute(f"INSERT INTO {table} {query};")
+    conn.commit()
+    cursor.close()
+    print (" Rollups rebuilt successfully!")
+
+
+def verify_rollups(conn):
+    """Compare both rollup tables with the base tables
+       Return True when they match row for row"""
+    cursor = conn.cursor()
+    matches = True
+    for table, query in _ROLLUP_BASE_QUERIES.items():
+        cursor.execute(f"""
             SELECT
-                c.customer_name,
-                COUNT(o.order_id) AS total_orders
-            FROM
-                Customer c
-                JOIN Orders o ON c.customer_id = o.customer_id
-            GROUP BY
-                c.customer_name
-            ORDER BY
-                total_orders DESC
-            LIMIT 3;
+                (SELECT count(*) FROM (SELECT * FROM {table} EXCEPT {query}) stale),
+                (SELECT count(*) FROM ({query} EXCEPT SELECT * FROM {table}) missing);
         """)
-        result1 = cursor.fetchall()
+        stale, missing = cursor.fetchone()
+        if stale or missing:
+            matches = False
+            print(f"{table}: {stale} stale rows, {missing} missing rows")
+        else:
+            print(f"{table}: matches the base tables")
+    cursor.close()
+    return matches
+
+
+def stream_query(conn, query, params=None, itersize=STREAM_ITERSIZE):
+    """Yield the rows of query from a named server-side cursor that fetches
+       itersize rows per round trip, so memory stays flat however many rows match"""
+    # On an autocommit connection the cursor has to outlive its implicit transaction
+    cursor = conn.cursor(name=f"stream_{os.getpid()}_{next(_STREAM_CURSOR_IDS)}", withhold=conn.autocommit)
+    cursor.itersize = itersize
+    try:
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+    finally:
+        cursor.close()
+
+
+def retrieve_data(conn, use_rollups=False, itersize=STREAM_ITERSIZE):
+    """Print the top 3 customers by orders and the average price per category.
+       Rows are streamed from server-side cursors rather than fetched all at once.
+       With use_rollups=True both reports read the rollup tables instead of scanning
+       Orders and Products; customers are then ranked individually rather than
+       grouped by name."""
+    try:
+        # Query 1: Retrieve top 3 customers based on the number of orders placed
+        if use_rollups:
+            query1 = """
+                SELECT customer_name, order_count AS total_orders
+                FROM Customer_Order_Counts
+                ORDER BY order_count DESC
+                LIMIT 3;
+            """
+        else:
+            query1 = TOP_CUSTOMERS_QUERY
 
         print("\nQuery 1: Top 3 Customers based on Total Orders")
         print("-----------------------------------------------------------------")
-        for row in result1:
+        for row in stream_query(conn, query1, itersize=itersize):
             print(f"{row[0]}: {row[1]} orders")
 
         #  Query 2: Retrieve product categories and the average price
-        cursor.execute("""
-            SELECT
-                p.product_categories,
-                AVG(p.product_price::numeric) AS average_price
-            FROM
-                Products p
-            GROUP BY
-                p.product_categories
-            ORDER BY
-                average_price DESC;
-        """)
-        result2 = cursor.fetchall()
+        if use_rollups:
+            query2 = """
+                SELECT product_categories, price_sum / NULLIF(price_count, 0) AS average_price
+                FROM Category_Price_Stats
+                ORDER BY average_price DESC;
+            """
+        else:
+            query2 = CATEGORY_AVERAGE_PRICE_QUERY
 
         print("\ Query 2: Product Categories and Average Price")
         print("----------------------------------------------------")
-        for row in result2:
+        for row in stream_query(conn, query2, itersize=itersize):
             print(f"{row[0]}: ${row[1]:.2f}")
 
-        cursor.close()
-
     except Exception as error:
         print(f"Error retrieving data: {error}")
+
+
+async def async_connect(dbname=DATABASE_NAME, autocommit=False):
+    """Open a psycopg 3 AsyncConnection to dbname. This is not taken from the
+       ConnectionPool: that pool holds psycopg2 connections, which cannot be awaited,
+       so the async helpers open their own and close them when done"""
+    if psycopg is None:
+        raise RuntimeError("The asyncio layer needs psycopg 3: pip install 'psycopg[binary]'")
+    return await psycopg.AsyncConnection.connect(postgres_dsn(dbname), autocommit=autocommit)
+
+
+async def _async_reserve_ids(cursor, table, column, count):
+    await cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                         (table, column, count))
+    return [row[0] for row in await cursor.fetchall()]
+
+
+async def _async_load_range(dbname, start_order_id, num_records, batch_size, distribution, seed):
+    """Generate and insert num_records records on one connection, a batch at a time,
+       each batch as one COPY per table in a single transaction, so statement-level
+       triggers fire once per table per batch"""
+    conn = await async_connect(dbname)
+    customer_rng, payment_rng = registry_streams(None if seed is None else seed + start_order_id)
+    customers = KeyRegistry(distribution, rng=customer_rng)
+    payments = KeyRegistry(rng=payment_rng)
+    try:
+        async with conn.cursor() as cursor:
+            for offset in range(0, num_records, batch_size):
+                # Generated per batch like bulk_insert_random_data(), so memory stays flat
+                batch = generate_random_batch(min(batch_size, num_records - offset), seed=seed,
+                                              chunk=start_order_id + offset)
+                customer_ids = await _async_reserve_ids(cursor, 'customer', 'customer_id', len(batch))
+                payment_ids = await _async_reserve_ids(cursor, 'payments', 'payment_id', len(batch))
+                order_ids = range(start_order_id + offset, start_order_id + offset + len(batch))
+                rows = _record_rows(batch, customer_ids, payment_ids, order_ids, customers, payments)
+                # Concurrent batches can deadlock on shared rollup rows; the loser retries
+                for attempt in range(1, ASYNC_RETRIES + 1):
+                    try:
+                        for table, columns in LOAD_COLUMNS.items():
+                            async with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                                await copy.write(''.join('\t'.join(_copy_escape(value) for value in row) + '\n'
+                                                         for row in rows[table]))
+                        await conn.commit()
+                        break
+                    except psycopg.errors.DeadlockDetected:
+                        await conn.rollback()
+                        if attempt == ASYNC_RETRIES:
+                            raise
     finally:
-        
+        await conn.close()
+
+
+async def async_insert_random_data(dbname, num_records, concurrency=ASYNC_CONCURRENCY, batch_size=ASYNC_BATCH_SIZE,
+                                   seed=None, distribution='uniform'):
+    """Load num_records generated records from concurrency coroutines, each on its
+       own connection and owning a disjoint order_id range
+       Return the seconds taken"""
+    if num_records <= 0:
+        return 0.0
+    per_task = -(-num_records // concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        _async_load_range(dbname, first, min(per_task, num_records - first), batch_size, distribution, seed)
+        for first in range(0, num_records, per_task)))
+    seconds = time.perf_counter() - start
+    print(f"Async load of {num_records} records over {concurrency} connections: "
+          f"{num_records / seconds:,.0f} records/sec")
+    return seconds
+
+
+async def async_run_queries(dbname, queries, concurrency=ASYNC_CONCURRENCY):
+    """Run (query, params) pairs from one coroutine each, sharing concurrency connections
+       that act as a small pool for this call only (see async_connect)
+       Return the rows of every query, in the order given"""
+    connections = [await async_connect(dbname, autocommit=True) for _ in range(concurrency)]
+    idle = asyncio.Queue()
+    for conn in connections:
+        idle.put_nowait(conn)
+
+    async def run(query, params):
+        conn = await idle.get()
+        try:
+            cursor = await conn.execute(query, params)
+            return await cursor.fetchall()
+        finally:
+            idle.put_nowait(conn)
+
+    try:
+        return await asyncio.gather(*(run(query, params) for query, params in queries))
+    finally:
+        for conn in connections:
+            await conn.close()
+
+
+async def async_pipelined_queries(conn, queries):
+    """Send every (query, params) pair on conn in pipeline mode without waiting for
+       the previous result, then collect all the results. Consecutive pairs with the
+       same query go out as one executemany, one result set per pair."""
+    cursors = []
+    async with conn.pipeline():
+        for query, group in itertools.groupby(queries, key=lambda pair: pair[0]):
+            cursor = conn.cursor()
+            await cursor.executemany(query, [params for _, params in group], returning=True)
+            cursors.append(cursor)
+    results = []
+    for cursor in cursors:
+        while True:
+            results.append(await cursor.fetchall())
+            if not cursor.nextset():
+                break
+        await cursor.close()
+    return results
+
+
+async def async_run_pipelined(dbname, queries, concurrency=ASYNC_CONCURRENCY):
+    """Split (query, params) pairs across concurrency connections, each sending its
+       share with async_pipelined_queries()
+       Return the rows of every query, in the order given"""
+    per_connection = -(-len(queries) // concurrency) if queries else 1
+    shares = [queries[first:first + per_connection] for first in range(0, len(queries), per_connection)]
+    connections = [await async_connect(dbname, autocommit=True) for _ in shares]
+    try:
+        results = await asyncio.gather(*(async_pipelined_queries(conn, share)
+                                         for conn, share in zip(connections, shares)))
+    finally:
+        for conn in connections:
+            await conn.close()
+    return [rows for share in results for rows in share]
+
+
+async def async_retrieve_data(dbname=DATABASE_NAME):
+    """retrieve_data() with both reports running concurrently"""
+    top_customers, category_prices = await async_run_queries(
+        dbname, [(TOP_CUSTOMERS_QUERY, None), (CATEGORY_AVERAGE_PRICE_QUERY, None)], concurrency=2)
+
+    print("\nQuery 1: Top 3 Customers based on Total Orders")
+    print("-----------------------------------------------------------------")
+    for row in top_customers:
+        print(f"{row[0]}: {row[1]} orders")
+
+    print("\ Query 2: Product Categories and Average Price")
+    print("----------------------------------------------------")
+    for row in category_prices:
+        print(f"{row[0]}: ${row[1]:.2f}")
+
+
+def pipeline_stages(num_records, dbname=DATABASE_NAME, bulk=False, chunk_size=BULK_CHUNK_SIZE, workers=1,
+                    seed=None, distribution='uniform', partitioning='inherits', replication='statement',
+                    rollups=False, fast=False, asynchronous=False, time_partitions=False):
+    """The pipeline as (stage name, function of the connection, records loaded) tuples, in run order"""
+    def partition(conn):
+        if partitioning == 'declarative':
+            declarative_horizontal_partitioning(conn)
+        else:
+            horizontal_partitioning(conn)
+
+    def load(conn):
+        customer_rng, payment_rng = registry_streams(seed)
+        customers = KeyRegistry(distribution, rng=customer_rng)
+        payments = KeyRegistry(rng=payment_rng)
+        if asynchronous:
+            asyncio.run(async_insert_random_data(dbname, num_records, seed=seed, distribution=distribution))
+        elif bulk and workers > 1:
+            parallel_insert_random_data(dbname, num_records, workers=workers, chunk_size=chunk_size,
+                                        seed=seed, distribution=distribution)
+        elif bulk:
+            bulk_insert_random_data(conn, num_records, chunk_size=chunk_size, seed=seed, customers=customers,
+                                    payments=payments)
+        else:
+            start = time.perf_counter()
+            insert_random_data(conn, num_records, customers=customers, payments=payments,
+                               partition_mode=partitioning)
+            elapsed = time.perf_counter() - start
+            print(f"Row-at-a-time load: {num_records / elapsed:,.0f} records/sec")
+
+    stages = [('create_tables', create_tables, 0)]
+    if time_partitions:
+        stages.append(('time_partitioning', time_partitioning, 0))
+    stages += [
+        ('vertical_partitioning', vertical_partitioning, 0),
+        ('horizontal_partitioning', partition, 0),
+        ('create_replicated_tables', create_replicated_tables, 0),
+        ('create_replication_trigger', lambda conn: create_replication_trigger(conn, mode=replication), 0),
+    ]
+    if rollups:
+        stages.append(('create_rollups', create_rollups, 0))
+    if fast:
+        stages.append(('insert_random_data', lambda conn: fast_load(conn, load, dbname=dbname), num_records))
+    else:
+        stages.append(('insert_random_data', load, num_records))
+    if replication == 'deferred':
+        stages.append(('apply_pending_replication', apply_pending_replication, 0))
+    stages.append(('IndexCreation', IndexCreation, 0))
+    stages.append(('create_workload_indexes', create_workload_indexes, 0))
+    stages.append(('retrieve_data', lambda conn: retrieve_data(conn, use_rollups=rollups), 0))
+    return stages
+
+
+def _run_stage(conn, name, stage, records):
+    """Run one pipeline stage and measure wall time and the WAL it generated"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_current_wal_lsn();")
+    lsn_before = cursor.fetchone()[0]
+    start = time.perf_counter()
+    stage(conn)
+    seconds = time.perf_counter() - start
+    cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s);", (lsn_before,))
+    wal_bytes = int(cursor.fetchone()[0])
+    cursor.close()
+    return {'stage': name, 'seconds': seconds, 'records': records,
+            'records_per_sec': records / seconds if records and seconds else None, 'wal_bytes': wal_bytes}
+
+
+def _relation_sizes(conn):
+    """Heap and index bytes of every table in the public schema"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.relname, pg_table_size(c.oid), pg_indexes_size(c.oid)
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+        ORDER BY c.relname;
+    """)
+    sizes = {name: {'table_bytes': table_bytes, 'index_bytes': index_bytes}
+             for name, table_bytes, index_bytes in cursor.fetchall()}
+    cursor.close()
+    return sizes
+
+
+def benchmark_pipeline(scales=BENCHMARK_SCALES, output=None, label=None, dbname='finalproject_bench', **options):
+    """Run the whole pipeline once per scale in a fresh scratch database, timing every
+       stage and recording WAL volume and final table/index sizes.
+       options are passed to pipeline_stages(). The report is written as JSON to
+       output (or printed) and returned."""
+    # Every run generates the same data unless a seed is given
+    options['seed'] = 0 if options.get('seed') is None else options['seed']
+    report = {'label': label, 'started_at': datetime.now().isoformat(timespec='seconds'),
+              'options': options, 'runs': []}
+    for scale in scales:
+        create_database(dbname)
+        with pooled_connection(dbname) as conn:
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("SHOW server_version;")
+            report['server_version'] = cursor.fetchone()[0]
+            cursor.close()
+
+            run = {'records': scale, 'stages': []}
+            for name, stage, records in pipeline_stages(scale, dbname=dbname, **options):
+                run['stages'].append(_run_stage(conn, name, stage, records))
+            run['total_seconds'] = sum(entry['seconds'] for entry in run['stages'])
+            run['relations'] = _relation_sizes(conn)
+            report['runs'].append(run)
+        close_pool(dbname)
+
+        print(f"\nPipeline at {scale} records")
+        print("----------------------------------------------------")
+        for entry in run['stages']:
+            print(f"{entry['stage']:<28} {entry['seconds']:>9.3f}s {entry['wal_bytes'] / 2 ** 20:>9.1f} MB WAL")
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Benchmark report written to {output}")
+    else:
+        print(json.dumps(report, indent=2))
+    return report
+
+
+def _stages_until_load(conn, num_records, dbname, **options):
+    """Run the pipeline stages that come before the load
+       Return the load stage itself"""
+    for name, stage, _ in pipeline_stages(num_records, dbname=dbname, **options):
+        if name == 'insert_random_data':
+            return stage
+        stage(conn)
+
+
+def benchmark_fast_load(num_records=100000, dbname='finalproject_bench', **options):
+    """Load num_records into an already indexed schema twice, once normally and once
+       through fast_load(), and report the time saved including the rebuild"""
+    options['seed'] = 0 if options.get('seed') is None else options['seed']
+    seconds = {}
+    for fast in (False, True):
+        create_database(dbname)
+        with pooled_connection(dbname) as conn:
+            conn.autocommit = True
+            load = _stages_until_load(conn, num_records, dbname, **dict(options, fast=fast))
+            IndexCreation(conn)
+            create_workload_indexes(conn)
+            start = time.perf_counter()
+            load(conn)
+            seconds[fast] = time.perf_counter() - start
+        close_pool(dbname)
+
+    print(f"\nLoading {num_records} records into an indexed schema")
+    print("----------------------------------------------------")
+    print(f"regular load: {seconds[False]:.2f}s")
+    print(f"fast load:    {seconds[True]:.2f}s (saved {seconds[False] - seconds[True]:.2f}s)")
+    return {'regular_seconds': seconds[False], 'fast_seconds': seconds[True],
+            'saved_seconds': seconds[False] - seconds[True]}
+
+
+def benchmark_statement_cache(num_records=20000, dbname='finalproject_bench', **options):
+    """Run insert_random_data() for num_records with plain queries and again with
+       prepared statements, each into a fresh schema. The records are generated up
+       front so only database time is measured."""
+    options = dict(options, bulk=False, workers=1)
+    records = generate_random_batch(num_records, seed=options.get('seed') or 0)
+    results = {}
+    for mode, cache in (('plain', None), ('prepared', StatementCache())):
+        create_database(dbname)
+        with pooled_connection(dbname) as conn:
+            conn.autocommit = True
+            _stages_until_load(conn, num_records, dbname, **options)
+            start = time.perf_counter()
+            insert_random_data(conn, num_records, partition_mode=options.get('partitioning', 'inherits'),
+                               statement_cache=cache, records=records)
+            seconds = time.perf_counter() - start
+        close_pool(dbname)
+        results[mode] = {'seconds': seconds, 'records_per_sec': num_records / seconds}
+        if cache is not None:
+            results[mode].update(cache.stats())
+
+    print(f"\nRow-at-a-time load of {num_records} records")
+    print("----------------------------------------------------")
+    for mode, result in results.items():
+        print(f"{mode:<9} {result['records_per_sec']:,.0f} records/sec")
+    print(f"statement cache: {results['prepared']['hits']} hits, {results['prepared']['misses']} misses")
+    return results
+
+
+def benchmark_async(num_records=20000, lookups=5000, concurrency=ASYNC_CONCURRENCY, dbname='finalproject_bench',
+                    **options):
+    """Compare the synchronous COPY load of bulk_insert_random_data() with the asyncio
+       one, then answer lookups single-order queries one at a time, concurrently over
+       concurrency connections, and pipelined over the same connections"""
+    lookup = "SELECT order_id, order_date FROM Orders WHERE order_id = %s"
+    order_ids = np.random.default_rng(0).integers(0, num_records, lookups).tolist()
+    queries = [(lookup, (order_id,)) for order_id in order_ids]
+    results = {}
+
+    create_database(dbname)
+    with pooled_connection(dbname) as conn:
+        conn.autocommit = True
+        _stages_until_load(conn, num_records, dbname, **options)
+        start = time.perf_counter()
+        bulk_insert_random_data(conn, num_records, seed=0, verbose=False)
+        results['sync_load_records_per_sec'] = num_records / (time.perf_counter() - start)
+
+        cursor = conn.cursor()
+        start = time.perf_counter()
+        for order_id in order_ids:
+            cursor.execute(lookup, (order_id,))
+            cursor.fetchall()
+        results['sync_queries_per_sec'] = lookups / (time.perf_counter() - start)
         cursor.close()
+    close_pool(dbname)
 
+    create_database(dbname)
+    with pooled_connection(dbname) as conn:
+        conn.autocommit = True
+        _stages_until_load(conn, num_records, dbname, **options)
+    seconds = asyncio.run(async_insert_random_data(dbname, num_records, concurrency=concurrency, seed=0))
+    results['async_load_records_per_sec'] = num_records / seconds
 
-if __name__ == '__main__':
+    start = time.perf_counter()
+    asyncio.run(async_run_queries(dbname, queries, concurrency))
+    results['async_queries_per_sec'] = lookups / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    asyncio.run(async_run_pipelined(dbname, queries, concurrency))
+    results['pipelined_queries_per_sec'] = lookups / (time.perf_counter() - start)
+    close_pool(dbname)
+
+    print(f"\nSync vs asyncio ({concurrency} connections)")
+    print("----------------------------------------------------")
+    print(f"load:    {results['sync_load_records_per_sec']:,.0f} vs {results['async_load_records_per_sec']:,.0f} records/sec (COPY both)")
+    print(f"lookups: {results['sync_queries_per_sec']:,.0f} sync, {results['async_queries_per_sec']:,.0f} concurrent, "
+          f"{results['pipelined_queries_per_sec']:,.0f} pipelined queries/sec")
+    return results
 
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build and load the finalproject database")
+    parser.add_argument('--records', type=int, default=None,
+                        help="number of records to generate (default 100; the benchmarks use their own sizes)")
+    parser.add_argument('--bulk', action='store_true', help="load with COPY instead of row-at-a-time inserts")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help="records per COPY chunk")
+    parser.add_argument('--workers', type=int, default=1, help="processes for a parallel bulk load")
+    parser.add_argument('--seed', type=int, default=None, help="seed for reproducible bulk data")
+    parser.add_argument('--distribution', choices=('uniform', 'zipf'), default='uniform',
+                        help="how orders pick their customer")
+    parser.add_argument('--partitioning', choices=('inherits', 'declarative'), default='inherits',
+                        help="how Products is split by price")
+    parser.add_argument('--replication', choices=('row', 'statement', 'deferred'), default='statement',
+                        help="how new customers reach the Customer_Region_* tables")
+    parser.add_argument('--benchmark-generation', action='store_true',
+                        help="compare per-record and batched data generation, then exit")
+    parser.add_argument('--benchmark-partitioning', action='store_true',
+                        help="compare the two Products partitioning schemes, then exit")
+    parser.add_argument('--benchmark-vertical', action='store_true',
+                        help="compare date scans over Shipments and its narrow fragment, then exit")
+    parser.add_argument('--rollups', action='store_true',
+                        help="maintain rollup tables during the load and report from them")
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help="rebuild and verify the rollups of the existing database, then exit")
+    parser.add_argument('--fast-load', action='store_true',
+                        help="drop secondary indexes and foreign keys during the load and rebuild them afterwards")
+    parser.add_argument('--benchmark-fast-load', action='store_true',
+                        help="compare a regular and a fast load into an indexed schema, then exit")
+    parser.add_argument('--benchmark-statement-cache', action='store_true',
+                        help="compare plain and prepared row-at-a-time inserts, then exit")
+    parser.add_argument('--async-load', action='store_true',
+                        help="load through the asyncio layer, one COPY per table per batch (needs psycopg 3)")
+    parser.add_argument('--benchmark-async', action='store_true',
+                        help="compare the sync path with the asyncio layer, then exit")
+    parser.add_argument('--time-partitioning', action='store_true',
+                        help="partition Orders and Shipments by month")
+    parser.add_argument('--maintain-partitions', action='store_true',
+                        help="create upcoming and detach expired monthly partitions of the existing database, then exit")
+    parser.add_argument('--benchmark-time-partitioning', action='store_true',
+                        help="compare 30-day and full-history scans with and without monthly partitions, then exit")
+    parser.add_argument('--instrument', action='store_true',
+                        help="time every statement, EXPLAIN slow SELECTs and print a report at the end")
+    parser.add_argument('--instrument-slow-ms', type=float, default=INSTRUMENT_SLOW_MS,
+                        help="latency above which a SELECT gets an EXPLAIN (ANALYZE, BUFFERS) plan")
+    parser.add_argument('--instrument-output', help="file for the --instrument JSON report")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time every stage at each of --scales in a scratch database, then exit")
+    parser.add_argument('--scales', type=int, nargs='+', default=BENCHMARK_SCALES,
+                        help="record counts for --benchmark")
+    parser.add_argument('--output', help="file for the --benchmark JSON report")
+    parser.add_argument('--label', help="name for this --benchmark run, e.g. a git revision")
+    args = parser.parse_args()
+    options = dict(bulk=args.bulk, chunk_size=args.chunk_size, workers=args.workers, seed=args.seed,
+                   distribution=args.distribution, partitioning=args.partitioning,
+                   replication=args.replication, rollups=args.rollups, asynchronous=args.async_load,
+                   time_partitions=args.time_partitioning, fast=args.fast_load)
+    # Only pass --records on to a benchmark when it was given
+    benchmark_size = () if args.records is None else (args.records,)
+
+    if args.rebuild_rollups:
+        with pooled_connection(DATABASE_NAME) as conn:
+            create_rollups(conn)
+            rebuild_rollups(conn)
+            verified = verify_rollups(conn)
+        raise SystemExit(0 if verified else 1)
+    if args.benchmark:
+        benchmark_pipeline(args.scales, output=args.output, label=args.label, **options)
+        raise SystemExit(0)
+    if args.benchmark_fast_load:
+        benchmark_fast_load(*benchmark_size, **options)
+        raise SystemExit(0)
+    if args.benchmark_statement_cache:
+        benchmark_statement_cache(*benchmark_size, **options)
+        raise SystemExit(0)
+    if args.benchmark_async:
+        benchmark_async(*benchmark_size, **options)
+        raise SystemExit(0)
+    if args.maintain_partitions:
+        with pooled_connection(DATABASE_NAME) as conn:
+            maintain_time_partitions(conn)
+        raise SystemExit(0)
+    if args.benchmark_time_partitioning:
+        benchmark_time_partitioning(*benchmark_size)
+        raise SystemExit(0)
+    if args.benchmark_generation:
+        benchmark_generation(*benchmark_size, seed=args.seed)
+        raise SystemExit(0)
+    if args.benchmark_partitioning:
+        benchmark_products_partitioning(*benchmark_size)
+        raise SystemExit(0)
+    if args.benchmark_vertical:
+        benchmark_vertical_partitioning(*benchmark_size)
+        raise SystemExit(0)
+
+    if args.instrument:
+        enable_instrumentation(args.instrument_slow_ms)
     create_database(DATABASE_NAME)
-    with connect_potsgres(dbname=DATABASE_NAME) as conn:
+    with pooled_connection(DATABASE_NAME) as conn:
         conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-        num_records = 100 
-        create_tables(conn)
-        vertical_partitioning(conn)
-        horizontal_partitioning(conn)
-        insert_random_data(conn, num_records) 
-        create_replicated_tables(conn)
-        create_replication_trigger(conn)      
-        IndexCreation(conn)
-        retrieve_data(conn)
-        print('Done')
+        for name, stage, records in pipeline_stages(100 if args.records is None else args.records, **options):
+            if INSTRUMENTATION is not None:
+                INSTRUMENTATION.stage = name
+            stage(conn)
+    print_pool_metrics()
+    print_instrumentation_report(output=args.instrument_output)
+    print('Done')
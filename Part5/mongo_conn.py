@@ -12,20 +12,149 @@
 # docker ps
 # python mongo_conn.py
 
-from pymongo import MongoClient
+import argparse
+import copy
+import itertools
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from bson import ObjectId
+from pymongo import ASCENDING, DeleteOne, InsertOne, MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError
 import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
 
 DATABASE_NAME = 'EcommerceDB'
 COLLECTION_NAME = 'Customers'
 
+# Client settings, overridable from the environment
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+
+_CLIENT = None
+_CLIENT_PID = None
+_INDEXES_READY = False
+_CLIENT_LOCK = threading.Lock()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connections created and closed, checkouts and their wait times
+       for the shared client"""
+
+    def __init__(self):
+        self.stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'failed_checkouts': 0, 'checked_in': 0,
+                      'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+        self._lock = threading.Lock()
+        self._started = threading.local()
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.monotonic()
+
+    def connection_checked_out(self, event):
+        waited = time.monotonic() - getattr(self._started, 'at', time.monotonic())
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['wait_seconds'] += waited
+            self.stats['max_wait_seconds'] = max(self.stats['max_wait_seconds'], waited)
+
+    def connection_check_out_failed(self, event):
+        self._count('failed_checkouts')
+
+    def connection_checked_in(self, event):
+        self._count('checked_in')
+
+    def connection_created(self, event):
+        self._count('created')
+
+    def connection_closed(self, event):
+        self._count('closed')
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+        metrics['avg_wait_seconds'] = metrics['wait_seconds'] / metrics['checkouts'] if metrics['checkouts'] else 0.0
+        return metrics
+
+
+POOL_METRICS = PoolMetrics()
+
+
+def get_client():
+    """Return the process-wide MongoClient, creating it on first use.
+       A forked child gets its own client instead of sharing its parent's sockets."""
+    global _CLIENT, _CLIENT_PID, _INDEXES_READY
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT_PID != os.getpid():
+            _INDEXES_READY = False
+            _CLIENT = MongoClient(MONGO_URI,
+                                  maxPoolSize=MONGO_MAX_POOL_SIZE,
+                                  minPoolSize=MONGO_MIN_POOL_SIZE,
+                                  waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                                  connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                                  serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                  socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                                  event_listeners=[POOL_METRICS],
+                                  connect=False)
+            _CLIENT_PID = os.getpid()
+        return _CLIENT
+
+def close_client():
+    """Close the shared client; the next get_client() call opens a new one"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is not None and _CLIENT_PID == os.getpid():
+            _CLIENT.close()
+        _CLIENT = None
+
+def print_client_metrics():
+    """Print connections created and checkout wait times of the shared client"""
+    metrics = POOL_METRICS.metrics()
+    print(f"\nMongoDB pool: {metrics['created']} connections created / {metrics['closed']} closed, "
+          f"{metrics['checkouts']} checkouts ({metrics['failed_checkouts']} failed), "
+          f"avg wait {metrics['avg_wait_seconds'] * 1000:.2f} ms, max wait {metrics['max_wait_seconds'] * 1000:.2f} ms")
+
 def get_collection():
-    client = MongoClient()
-    db = client[DATABASE_NAME]
-    return db[COLLECTION_NAME]
+    global _INDEXES_READY
+    db = get_client()[DATABASE_NAME]
+    collection = db[COLLECTION_NAME]
+    # Build the query indexes once per client, on first use
+    if not _INDEXES_READY:
+        ensure_indexes(collection)
+        _INDEXES_READY = True
+    return collection
 
 def drop_collection():
-    client = MongoClient()
-    db = client[DATABASE_NAME]
+    global _INDEXES_READY
+    db = get_client()[DATABASE_NAME]
+    # The indexes go with the collection
+    _INDEXES_READY = False
 
     # Access the collection you want to delete
     collection = db[COLLECTION_NAME]
@@ -38,22 +167,56 @@ def drop_collection():
     else:
         print(f"Collection '{COLLECTION_NAME}' does not exist.")
 
+def name_key(customer_name):
+    """Case-folded form of a customer name, stored as customer_name_key so that
+       case-insensitive prefix searches become index range scans"""
+    return unicodedata.normalize('NFKC', customer_name).casefold()
+
+def _with_name_key(data):
+    """data with customer_name_key added when it sets customer_name"""
+    if isinstance(data.get("customer_name"), str):
+        return dict(data, customer_name_key=name_key(data["customer_name"]))
+    return data
+
+def ensure_indexes(collection=None):
+    """Create the indexes the queries below rely on, if they are missing"""
+    collection = collection if collection is not None else get_collection()
+    collection.create_index([("customer_name_key", ASCENDING), ("_id", ASCENDING)], name="customer_name_key")
+    # Region queries filter, sort and project on these fields alone, so they never fetch documents
+    collection.create_index([("customer_region", ASCENDING), ("customer_name", ASCENDING), ("_id", ASCENDING),
+                             ("customer_shipping_address", ASCENDING)], name="customer_region_location")
+
+def backfill_name_keys(batch_size=1000, collection=None):
+    """Set customer_name_key on documents written before it existed
+       Return the number of documents updated"""
+    collection = collection if collection is not None else get_collection()
+    updated = 0
+    batch = []
+    for customer in collection.find({"customer_name_key": {"$exists": False}, "customer_name": {"$type": "string"}},
+                                    {"customer_name": 1}):
+        batch.append(UpdateOne({"_id": customer["_id"]},
+                               {"$set": {"customer_name_key": name_key(customer["customer_name"])}}))
+        if len(batch) == batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated
+
 # Create (Insert) a new customer
 def create_customer(customer_name, customer_email, customer_shipping_address, customer_region):
     collection = get_collection()
     customer_data = {
         "customer_name": customer_name,
+        "customer_name_key": name_key(customer_name),
         "customer_email": customer_email,
         "customer_shipping_address": customer_shipping_address,
         "customer_region": customer_region
     }
+    # insert_one fills in _id, so the document is already what the server stored
     result = collection.insert_one(customer_data)
-    
-    inserted_customer_id = result.inserted_id
-    # Retrieve the inserted customer data
-    inserted_customer = collection.find_one({"_id": inserted_customer_id})
-    
-    return inserted_customer, inserted_customer_id
+
+    return customer_data, result.inserted_id
 
 # Read (Retrieve) a customer by ID
 def read_customer(customer_id):
@@ -61,110 +224,446 @@ def read_customer(customer_id):
     customer = collection.find_one({"_id": customer_id})
     return customer
 
-def update_customer(customer_id, new_data):
+def _included_fields(projection):
+    """Field paths an inclusion projection keeps, or None for no projection.
+       Exclusion projections are rejected: the after image could not honour them."""
+    if projection is None:
+        return None
+    if not isinstance(projection, dict):
+        return set(projection)
+    if any(not value for key, value in projection.items() if key != "_id"):
+        raise ValueError("update_customer only supports inclusion projections")
+    return {key for key, value in projection.items() if value}
+
+def _apply_set(document, fields, included=None):
+    """Copy of document with a $set of fields applied, limited to the included paths
+       Return None when the result cannot be built client-side: a path that runs
+       through an array or a non-document value, or a projection that keeps only
+       part of a subdocument the $set replaces."""
+    document = copy.deepcopy(document)
+    for path, value in fields.items():
+        if included is not None:
+            if any(field.startswith(path + ".") for field in included):
+                return None
+            if not any(path == field or path.startswith(field + ".") for field in included):
+                continue
+        target = document
+        *parents, leaf = path.split(".")
+        for parent in parents:
+            target = target.setdefault(parent, {})
+            if not isinstance(target, dict):
+                return None
+        target[leaf] = value
+    return document
+
+def update_customer(customer_id, new_data, projection=None):
+    """Apply new_data to a customer in one atomic round trip
+       Return the customer before and after the update, or (None, None) if there is
+       no such customer. projection, a list or dict of fields to include, trims both;
+       exclusion projections raise ValueError.
+       The after image is the before image with the $set applied. Paths into arrays
+       cannot be applied that way, so those updates re-read the document, which costs
+       a second round trip and is not atomic with the update."""
     collection = get_collection()
-    
-    # Fetch the customer data before the update
-    before_update = collection.find_one({"_id": customer_id})
-    
-    # Update the customer data
-    result = collection.update_one({"_id": customer_id}, {"$set": new_data})
-    
-    # Fetch the updated customer data
-    after_update = collection.find_one({"_id": customer_id})
-    
+    included = _included_fields(projection)
+
+    # Keep the search key in step with the name
+    new_data = _with_name_key(new_data)
+
+    # The server hands back the document as it was; the after image is that plus the $set
+    before_update = collection.find_one_and_update({"_id": customer_id}, {"$set": new_data},
+                                                   projection=projection, return_document=ReturnDocument.BEFORE)
+    if before_update is None:
+        return None, None
+    after_update = _apply_set(before_update, new_data, included)
+    if after_update is None:
+        after_update = collection.find_one({"_id": customer_id}, projection)
     return before_update, after_update
 
-def delete_customer(customer_id):
+def delete_customer(customer_id, projection=None):
+    """Delete a customer in one round trip
+       Return the deleted customer's details, or None if there was no such customer"""
     collection = get_collection()
-    
-    # Fetch the customer data before deletion
-    deleted_customer = collection.find_one({"_id": customer_id})
-    
-    # Delete the customer data
-    result = collection.delete_one({"_id": customer_id})
-    
-    # Return the deleted customer's details
-    return deleted_customer
+    return collection.find_one_and_delete({"_id": customer_id}, projection=projection)
+
+def iter_json_array(path, read_size=1 << 16):
+    """Yield the elements of the JSON array in path one at a time, reading the
+       file in read_size chunks instead of loading it whole.
+       Raise ValueError if the file is not a well-formed JSON array."""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'\s*')
+    separator = re.compile(r'\s*[,\]]')
+    with open(path, 'r') as file:
+        buffer = ''
+        position = 0
+        eof = False
+
+        def read_more():
+            # Keep only the unparsed tail, so each document is not re-sliced out of the buffer
+            nonlocal buffer, position, eof
+            chunk = file.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+        def next_char():
+            # The next non-whitespace character, or '' at the end of the file
+            nonlocal position
+            while True:
+                position = whitespace.match(buffer, position).end()
+                if position < len(buffer) or eof:
+                    return buffer[position:position + 1]
+                read_more()
+
+        if next_char() != '[':
+            raise ValueError(f"{path} does not contain a JSON array")
+        position += 1
+        if next_char() == ']':
+            return
+        while True:
+            if next_char() in (',', ']', ''):
+                raise ValueError(f"Expected an array element in {path}")
+            try:
+                document, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                # Read more and retry only when the element runs past the buffer: an
+                # open string, or an error within a \uXXXX escape of its end.
+                # Anything earlier is malformed however much more is read.
+                if eof or not (error.msg.startswith('Unterminated string') or len(buffer) - error.pos <= 6):
+                    raise
+                read_more()
+                continue
+            if buffer[position] not in '{["' and not eof and not separator.match(buffer, end):
+                # A number or literal cut off by the buffer end still decodes; wait for what follows it
+                read_more()
+                continue
+            yield document
+            position = end
+
+            following = next_char()
+            if following == ']':
+                return
+            if following != ',':
+                raise ValueError(f"Expected ',' or ']' between elements of {path}, found {following!r}")
+            position += 1
+
+def _insert_batch(collection, batch):
+    """Insert one unordered batch; return (inserted, failed)"""
+    try:
+        return len(collection.insert_many(batch, ordered=False).inserted_ids), 0
+    except BulkWriteError as error:
+        inserted = error.details.get('nInserted', 0)
+        return inserted, len(batch) - inserted
+
+def bulk_customer_changes(creates=(), updates=(), deletes=(), ordered=True, collection=None):
+    """Apply many customer changes in as few round trips as bulk_write allows.
+       creates are customer documents, updates are (customer_id, new_data) pairs and
+       deletes are customer ids; they are sent in that order. With ordered=True the
+       first failing operation stops the rest, otherwise every operation is tried.
+       Return the counts plus one result per operation, in input order, with its
+       status ('ok', 'not_found', 'error' or 'not_executed') and error message.
+       'not_found' marks an update or delete whose customer did not exist; it is
+       worked out from one _id lookup made before the write, so a concurrent writer
+       can still race it."""
+    collection = collection if collection is not None else get_collection()
+    operations = []
+    results = []
+    for position, customer in enumerate(creates):
+        # Copy so the generated _id never leaks into the caller's document
+        customer = dict(_with_name_key(customer))
+        customer.setdefault("_id", ObjectId())
+        operations.append(InsertOne(customer))
+        results.append({"op": "create", "position": position, "_id": customer["_id"]})
+    for position, (customer_id, new_data) in enumerate(updates):
+        operations.append(UpdateOne({"_id": customer_id}, {"$set": _with_name_key(new_data)}))
+        results.append({"op": "update", "position": position, "_id": customer_id})
+    for position, customer_id in enumerate(deletes):
+        operations.append(DeleteOne({"_id": customer_id}))
+        results.append({"op": "delete", "position": position, "_id": customer_id})
+
+    summary = {"inserted": 0, "matched": 0, "modified": 0, "deleted": 0, "errors": [], "results": results}
+    if not operations:
+        return summary
+
+    targeted = [result["_id"] for result in results if result["op"] != "create"]
+    existing = set()
+    if targeted:
+        existing = {document["_id"] for document in collection.find({"_id": {"$in": targeted}}, {"_id": 1})}
+
+    write_errors = []
+    try:
+        outcome = collection.bulk_write(operations, ordered=ordered).bulk_api_result
+    except BulkWriteError as error:
+        outcome = error.details
+        write_errors = outcome.get("writeErrors", [])
+        summary["errors"] = [error["errmsg"] for error in outcome.get("writeConcernErrors", [])]
+
+    summary.update(inserted=outcome.get("nInserted", 0), matched=outcome.get("nMatched", 0),
+                   modified=outcome.get("nModified", 0), deleted=outcome.get("nRemoved", 0))
+    for result in results:
+        result["status"] = "ok"
+        result["error"] = None
+    for error in write_errors:
+        results[error["index"]].update(status="error", error=error["errmsg"])
+        summary["errors"].append(f"{results[error['index']]['op']} #{results[error['index']]['position']}: "
+                                 f"{error['errmsg']}")
+    # An ordered bulk write stops at its first error
+    if ordered and write_errors:
+        for result in results[write_errors[0]["index"] + 1:]:
+            result["status"] = "not_executed"
+    # Replay the batch against the ids that existed beforehand to spot the
+    # updates and deletes that matched nothing
+    for result in results:
+        if result["status"] != "ok":
+            continue
+        if result["op"] == "create":
+            existing.add(result["_id"])
+        elif result["_id"] not in existing:
+            result["status"] = "not_found"
+        elif result["op"] == "delete":
+            existing.discard(result["_id"])
+    return summary
+
+def create_customers(customers, ordered=True):
+    """Insert many customer documents with one bulk_write; see bulk_customer_changes()"""
+    return bulk_customer_changes(creates=customers, ordered=ordered)
+
+def update_customers(updates, ordered=True):
+    """Apply (customer_id, new_data) pairs with one bulk_write; see bulk_customer_changes()"""
+    return bulk_customer_changes(updates=updates, ordered=ordered)
+
+def delete_customers(customer_ids, ordered=True):
+    """Delete many customers by id with one bulk_write; see bulk_customer_changes()"""
+    return bulk_customer_changes(deletes=customer_ids, ordered=ordered)
 
 # Creation operation 
-def insert_mock_data():
-    """Inserts the generated Mock data in JSON file into the MongoDB."""
+def insert_mock_data(path='mock_data.json', batch_size=1000, writers=1):
+    """Stream the JSON array in path into the MongoDB in unordered batches of
+       batch_size, from writers threads when writers > 1.
+       Return the number of documents inserted and failed."""
     collection = get_collection()
-
-    with open('mock_data.json', 'r') as file:
-        mock_data = json.load(file)
-
-    result = collection.insert_many(mock_data)
-    inserted_ids = result.inserted_ids
-
-    # Retrieve all inserted data
-    all_customers = collection.find()
-    
+    inserted = failed = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=writers) as executor:
+        # Cap batches in flight so memory stays bounded however large the file is
+        pending = set()
+        batch = []
+        for document in iter_json_array(path):
+            if isinstance(document.get("customer_name"), str):
+                document["customer_name_key"] = name_key(document["customer_name"])
+            batch.append(document)
+            if len(batch) == batch_size:
+                pending.add(executor.submit(_insert_batch, collection, batch))
+                batch = []
+                if len(pending) >= writers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch_inserted, batch_failed = future.result()
+                        inserted += batch_inserted
+                        failed += batch_failed
+        if batch:
+            pending.add(executor.submit(_insert_batch, collection, batch))
+        for future in pending:
+            batch_inserted, batch_failed = future.result()
+            inserted += batch_inserted
+            failed += batch_failed
+
+    seconds = time.perf_counter() - start
     print("\n Insertion Operation")
-    print("\n Customer Details:")
-
-    # Print details of each customer
-    for customer in all_customers:
-        print(customer)
-    
-    # Count total number of entries
-    total_entries = collection.count_documents({})
-    print(f"Total number of entries: {total_entries}")
+    print(f"Inserted {inserted} documents ({failed} failed) in {seconds:.2f}s, "
+          f"{inserted / seconds if seconds else 0:,.0f} docs/sec")
+    return inserted, failed
+
+def _region_query(region, after=None):
+    """Filter on region, resuming after the (customer_name, _id) of a previous page"""
+    if after is None:
+        return {"customer_region": region}
+    after_name, after_id = after
+    return {"customer_region": region,
+            "$or": [{"customer_name": {"$gt": after_name}},
+                    {"customer_name": after_name, "_id": {"$gt": after_id}}]}
+
+def iter_customers_by_region(region, batch_size=1000, after=None, fields=("customer_name",), collection=None):
+    """Stream a region's customers in name order as documents holding _id and fields,
+       batch_size documents per round trip. Fields from customer_name and
+       customer_shipping_address keep the query covered by the customer_region_location
+       index, so no document is fetched. after resumes behind a (customer_name, _id)
+       already seen."""
+    collection = collection if collection is not None else get_collection()
+    cursor = (collection.find(_region_query(region, after), {field: 1 for field in ("_id",) + tuple(fields)})
+              .sort([("customer_name", ASCENDING), ("_id", ASCENDING)])
+              .batch_size(batch_size))
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+def page_customers_by_region(region, limit=100, after=None, fields=("customer_name",), collection=None):
+    """One page of iter_customers_by_region()
+       Return (customers, token for the next page or None)"""
+    fields = tuple(fields) if "customer_name" in fields else tuple(fields) + ("customer_name",)
+    page = list(itertools.islice(iter_customers_by_region(region, batch_size=limit, after=after, fields=fields,
+                                                          collection=collection), limit))
+    token = (page[-1].get("customer_name"), page[-1]["_id"]) if limit and len(page) == limit else None
+    return page, token
 
 # Sample Query: Retrieve all customer names from a specific region
-def retrieve_customer_names_by_region(region):
-    collection = get_collection()
-    # Use the find() method to query customers by region
-    customers = collection.find({"customer_region": region})
-    # Extract customer names and store them in a list
-    customer_names = [customer["customer_name"] for customer in customers]
-    return customer_names
-
-def get_customers_detail_location():
-    collection = get_collection()
-
-    # Aggregation pipeline to filter records where customer_region = 'AR'
-    pipeline = [
-        {"$match": {"customer_region": "AR"}}
-    ]
-
-    # Perform aggregation using the defined pipeline
-    result = collection.aggregate(pipeline)
+def retrieve_customer_names_by_region(region, batch_size=1000):
+    # Only the names leave the index; no customer document is fetched
+    return [customer.get("customer_name") for customer in iter_customers_by_region(region, batch_size)]
+
+def get_customers_detail_location(region="AR", batch_size=1000, after=None):
+    """Stream name and shipping address of a region's customers, covered by the
+       customer_region_location index; see iter_customers_by_region() for after"""
+    return iter_customers_by_region(region, batch_size, after,
+                                    fields=("customer_name", "customer_shipping_address", "customer_region"))
+
+def search_customers_by_name_prefix(prefix, limit=50, after=None, projection=None, collection=None):
+    """Customers whose name starts with prefix, ignoring case, in name order.
+       The prefix becomes a range on the customer_name_key index. Pass the returned
+       cursor token as after to get the next page.
+       Return (customers, token for the next page or None)"""
+    collection = collection if collection is not None else get_collection()
+    key = name_key(prefix)
+    bounds = {"$gte": key}
+    if key:
+        # Everything below the prefix with its last character bumped shares the prefix
+        bounds["$lt"] = key[:-1] + chr(ord(key[-1]) + 1)
+    query = {"customer_name_key": bounds}
+    if after is not None:
+        after_key, after_id = after
+        query = {"$and": [query, {"$or": [{"customer_name_key": {"$gt": after_key}},
+                                          {"customer_name_key": after_key, "_id": {"$gt": after_id}}]}]}
+    if projection is not None:
+        projection = dict(projection, customer_name_key=1)
+
+    customers = list(collection.find(query, projection)
+                     .sort([("customer_name_key", ASCENDING), ("_id", ASCENDING)])
+                     .limit(limit))
+    token = (customers[-1]["customer_name_key"], customers[-1]["_id"]) if limit and len(customers) == limit else None
+    return customers, token
+
+def get_customers_detail_name(prefix="A"):
+    customers, _ = search_customers_by_name_prefix(prefix, limit=0)
 
     # Print the matching records
-    print("\nCustomers in region 'AR':")
-    for customer in result:
+    print(f"\nCustomers with names starting with '{prefix}':")
+    for customer in customers:
         print(customer)
 
-def get_customers_detail_name():
-    collection = get_collection()
+def _legacy_create_customer(collection, customer_data):
+    result = collection.insert_one(customer_data)
+    return collection.find_one({"_id": result.inserted_id}), result.inserted_id
 
-    # Aggregation pipeline to filter records where customer_name starts with 'A'
-    pipeline = [
-        {
-            "$match": {
-                "customer_name": {"$regex": "^A", "$options": "i"}  # Using regex to match names starting with 'A' (case-insensitive)
-            }
-        }
-    ]
+def _legacy_update_customer(collection, customer_id, new_data):
+    before_update = collection.find_one({"_id": customer_id})
+    collection.update_one({"_id": customer_id}, {"$set": new_data})
+    return before_update, collection.find_one({"_id": customer_id})
 
-    # Perform aggregation using the defined pipeline
-    result = collection.aggregate(pipeline)
+def _legacy_delete_customer(collection, customer_id):
+    deleted_customer = collection.find_one({"_id": customer_id})
+    collection.delete_one({"_id": customer_id})
+    return deleted_customer
 
-    # Print the matching records
-    print("\nCustomers with names starting with 'A':")
-    for customer in result:
-        print(customer)
+def benchmark_crud_round_trips(runs=1000):
+    """Time create, update and delete as find-then-write round trips, the way they
+       used to work, against the single round trip versions above"""
+    collection = get_collection()
+
+    def timed(operation, arguments):
+        start = time.perf_counter()
+        results = [operation(*argument) for argument in arguments]
+        return (time.perf_counter() - start) / len(arguments) * 1000, results
+
+    def new_customers():
+        return [{"customer_name": f"Bench {i}", "customer_name_key": f"bench {i}",
+                 "customer_email": f"bench{i}@example.com", "customer_shipping_address": "1 Bench St",
+                 "customer_region": "US"} for i in range(runs)]
+
+    legacy = {}
+    legacy['create'], created = timed(lambda customer: _legacy_create_customer(collection, customer),
+                                      [(customer,) for customer in new_customers()])
+    ids = [customer_id for _, customer_id in created]
+    legacy['update'], _ = timed(lambda customer_id: _legacy_update_customer(
+        collection, customer_id, {"customer_email": "updated@example.com"}), [(i,) for i in ids])
+    legacy['delete'], _ = timed(lambda customer_id: _legacy_delete_customer(collection, customer_id),
+                                [(i,) for i in ids])
+
+    current = {}
+    current['create'], created = timed(create_customer, [(customer["customer_name"], customer["customer_email"],
+                                                           customer["customer_shipping_address"],
+                                                           customer["customer_region"])
+                                                          for customer in new_customers()])
+    ids = [customer_id for _, customer_id in created]
+    current['update'], _ = timed(update_customer, [(i, {"customer_email": "updated@example.com"}) for i in ids])
+    current['delete'], _ = timed(delete_customer, [(i,) for i in ids])
+
+    print(f"\nCRUD latency per call, {runs} calls each")
+    print("----------------------------------------------------")
+    for operation in ('create', 'update', 'delete'):
+        print(f"{operation:<8} legacy {legacy[operation]:.3f} ms, single round trip {current[operation]:.3f} ms "
+              f"({legacy[operation] / current[operation]:.1f}x)")
+    return {'legacy_ms': legacy, 'current_ms': current}
+
+def benchmark_name_search(num_customers=1000000, prefixes=("A", "ma", "Jo", "zz"), limit=50, runs=5,
+                          batch_size=10000):
+    """Load num_customers synthetic customers into a scratch collection and time the
+       case-insensitive regex against the indexed prefix search, first page and
+       full result set"""
+    rng = random.Random(0)
+    syllables = ["an", "ma", "jo", "li", "sa", "ra", "el", "to", "ke", "ni", "zo", "be", "da", "fi"]
+    collection = get_client()[DATABASE_NAME]["Customers_bench"]
+    collection.drop()
+    for first in range(0, num_customers, batch_size):
+        batch = []
+        for _ in range(min(batch_size, num_customers - first)):
+            customer_name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+            batch.append({"customer_name": customer_name, "customer_name_key": name_key(customer_name),
+                          "customer_region": rng.choice(["US", "CN", "RU", "ES", "ZA", "AR"])})
+        collection.insert_many(batch, ordered=False)
+    ensure_indexes(collection)
+
+    def timed(search):
+        start = time.perf_counter()
+        for _ in range(runs):
+            found = search()
+        return (time.perf_counter() - start) / runs * 1000, found
+
+    print(f"\nName prefix search over {num_customers} customers")
+    print("----------------------------------------------------")
+    for prefix in prefixes:
+        regex = {"customer_name": {"$regex": "^" + re.escape(prefix), "$options": "i"}}
+        regex_page, _ = timed(lambda: len(list(collection.find(regex).limit(limit))))
+        regex_all, matches = timed(lambda: len(list(collection.find(regex, {"_id": 1}))))
+        index_page, _ = timed(lambda: len(search_customers_by_name_prefix(prefix, limit, collection=collection)[0]))
+        index_all, _ = timed(lambda: len(search_customers_by_name_prefix(prefix, 0, projection={"_id": 1},
+                                                                           collection=collection)[0]))
+        print(f"'{prefix}' ({matches} matches): regex {regex_page:.1f} ms first {limit} / {regex_all:.1f} ms all, "
+              f"indexed {index_page:.1f} ms first {limit} / {index_all:.1f} ms all")
+    collection.drop()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MongoDB customer CRUD demo")
+    parser.add_argument('--customers', type=int, default=1000000, help="collection size for the benchmarks")
+    parser.add_argument('--benchmark-name-search', action='store_true',
+                        help="compare regex and indexed name prefix search, then exit")
+    parser.add_argument('--benchmark-crud', action='store_true',
+                        help="compare the old find-then-write CRUD calls with single round trip ones, then exit")
+    parser.add_argument('--runs', type=int, default=1000, help="calls per operation for --benchmark-crud")
+    args = parser.parse_args()
+
+    if args.benchmark_crud:
+        benchmark_crud_round_trips(args.runs)
+        raise SystemExit(0)
+    if args.benchmark_name_search:
+        benchmark_name_search(args.customers)
+        raise SystemExit(0)
 
-    # database name company
-    db = MongoClient().ecommercedb
-    
     drop_collection()
 
     insert_mock_data()
+    backfill_name_keys()
 
     # Insert a new customer
     new_customer_name = "Ayush Joshi"
@@ -204,7 +703,12 @@ if __name__ == '__main__':
         print(customer_name)
 
     # Aggregation Pipeline Function for queries and data retrieval operations
-    get_customers_detail_location()
+    print("\nCustomers in region 'AR':")
+    for customer in get_customers_detail_location("AR"):
+        print(customer)
     get_customers_detail_name()
 
+    print_client_metrics()
+    close_client()
+
     print("\n The entire operation is completed.")
\ No newline at end of file
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+import unittest
+
+from mongo_conn import iter_json_array
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def parse(self, text, read_size):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as file:
+            file.write(text)
+        try:
+            return list(iter_json_array(file.name, read_size=read_size))
+        finally:
+            os.remove(file.name)
+
+    def test_matches_json_load_for_every_read_size(self):
+        text = ' [12345, 678, {"a": [1, 2], "b": "x,]y"}, true, null, -1.5e3 ,"z", "caf\\u00e9", false] \n'
+        for read_size in range(1, len(text) + 2):
+            self.assertEqual(self.parse(text, read_size), json.loads(text), read_size)
+
+    def test_mock_data(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_data.json')
+        with open(path) as file:
+            expected = json.load(file)
+        self.assertEqual(list(iter_json_array(path, read_size=37)), expected)
+
+    def test_empty_array(self):
+        self.assertEqual(self.parse(' [ ] ', 1), [])
+
+    def test_rejects_malformed_arrays(self):
+        for text in ('{"a": 1}', '[{"a":1} {"b":2}]', '[{"a":1},,,{"b":2}]', '[{"a":1},]', '[,{"a":1}]',
+                     '[{"a":1}', '[{"a":'):
+            for read_size in (1, 4, 1 << 16):
+                with self.assertRaises(ValueError, msg=(text, read_size)):
+                    self.parse(text, read_size)
+
+    def test_stops_at_early_error(self):
+        # Undecodable bytes after the error show whether the rest of the file was read
+        with tempfile.NamedTemporaryFile('wb', suffix='.json', delete=False) as file:
+            file.write(b'[{"a": 1}, {"a": 2 "b": 3}, ' + b' ' * (1 << 20) + b'\xff]')
+        try:
+            with self.assertRaises(json.JSONDecodeError):
+                list(iter_json_array(file.name, read_size=16))
+        finally:
+            os.remove(file.name)
+
+
+if __name__ == '__main__':
+    unittest.main()